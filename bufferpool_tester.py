@@ -0,0 +1,84 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, randrange, seed
+import shutil
+import sys
+import threading
+
+# BufferPool eviction: runs the same workload under every replacement policy with room for only a handful of
+# pages, so nearly every read faults a page back in from disk, then reopens the database with even fewer pages
+# and reads it from several threads at once
+number_of_records = 3000
+number_of_updates = 5000
+capacity = 16
+# Readers pin nothing, so the pool never runs over this; writers pin whole page ranges while they write
+read_capacity = 8
+num_threads = 8
+reader_passes = 4
+
+
+def check(query, records):
+    for key, columns in records.items():
+        record = query.select(key, 0, [1, 1, 1, 1, 1])[0]
+        if record.columns != columns:
+            print('select error on', key, ':', record.columns, ', correct:', columns)
+    for column in range(5):
+        result = query.sum(0, number_of_records - 1, column)
+        if result != sum(columns[column] for columns in records.values()):
+            print('sum error on column', column, ':', result, ', correct:',
+                  sum(columns[column] for columns in records.values()))
+
+
+for policy in ('lru', 'clock', '2q'):
+    shutil.rmtree('./ECS165_bufferpool', ignore_errors=True)
+    db = Database(bufferpool_capacity=capacity, replacement_policy=policy)
+    db.open('./ECS165_bufferpool')
+    grades_table = db.create_table('Grades', 5, 0)
+    query = Query(grades_table)
+    seed(3562901)
+
+    records = {}
+    for key in range(number_of_records):
+        records[key] = [key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]
+        query.insert(*records[key])
+    for _ in range(number_of_updates):
+        key = randrange(number_of_records)
+        columns = [None, None, None, None, None]
+        columns[randint(1, 4)] = randint(0, 20)
+        query.update(key, *columns)
+        records[key] = [old if new is None else new for old, new in zip(records[key], columns)]
+    if len(db.bufferpool.policy) > capacity:
+        print(policy, 'capacity error:', len(db.bufferpool.policy), 'pages resident, capacity:', capacity)
+    check(query, records)
+    db.close()
+
+    db = Database(bufferpool_capacity=read_capacity, replacement_policy=policy)
+    db.open('./ECS165_bufferpool')
+    query = Query(db.get_table('Grades'))
+    check(query, records)
+
+    # Readers do not pin pages, so the page one thread faults in may be evicted by another right away
+    errors = []
+
+    def reader(offset):
+        for i in range(reader_passes * number_of_records):
+            key = (i * 7 + offset * 131) % number_of_records
+            found = query.select(key, 0, [1, 1, 1, 1, 1])
+            if not found or found[0].columns != records[key]:
+                errors.append((key, found and found[0].columns))
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sys.setswitchinterval(switch_interval)
+    for key, columns in errors:
+        print(policy, 'concurrent select error on', key, ':', columns, ', correct:', records[key])
+    if len(db.bufferpool.policy) > read_capacity:
+        print(policy, 'capacity error:', len(db.bufferpool.policy), 'pages resident, capacity:', read_capacity)
+    db.close()
+    print(policy, "finished")
@@ -0,0 +1,120 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, sample, seed
+import shutil
+
+# Bulk paths: inserts and updates records in batches with insert_many and update_many, on a cumulative and a
+# non-cumulative table, and checks that every malformed batch is rejected whole without touching the table
+number_of_records = 2000
+batch_size = 500
+number_of_update_batches = 60
+seed(3562901)
+
+
+def check(query, records, label):
+    for key, columns in records.items():
+        found = query.select(key, 0, [1, 1, 1, 1, 1])
+        if not found or found[0].columns != columns:
+            print(label, 'select error on', key, ':', found and found[0].columns, ', correct:', columns)
+    for column in range(5):
+        result = query.sum(0, 2 * number_of_records, column)
+        correct = sum(columns[column] for columns in records.values())
+        if result != correct:
+            print(label, 'sum error on column', column, ':', result, ', correct:', correct)
+
+
+shutil.rmtree('./ECS165_bulk', ignore_errors=True)
+db = Database()
+db.open('./ECS165_bulk')
+tables = {'Cumulative': True, 'Sparse': False}
+all_records = {}
+for name, cumulative in tables.items():
+    table = db.create_table(name, 5, 0, cumulative)
+    query = Query(table)
+    records = all_records[name] = {}
+
+    for start in range(0, number_of_records, batch_size):
+        rows = [[key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]
+                for key in range(start, start + batch_size)]
+        if not query.insert_many(rows):
+            print(name, 'insert_many error on batch starting at', start)
+        for row in rows:
+            records[row[0]] = row
+
+    # Each of these must be rejected before anything is inserted, rows before the bad one included
+    next_key = number_of_records
+    bad_batches = [
+        ('short row', [[next_key, 1, 1, 1, 1], [next_key + 1, 1, 1, 1]]),
+        ('None value', [[next_key, 1, 1, 1, 1], [next_key + 1, None, 1, 1, 1]]),
+        ('string value', [[next_key, 1, 1, 1, 1], [next_key + 1, '1', 1, 1, 1]]),
+        ('float value', [[next_key, 1, 1, 1, 1], [next_key + 1, 1.5, 1, 1, 1]]),
+        ('value over 64 bits', [[next_key, 1, 1, 1, 1], [next_key + 1, 1 << 63, 1, 1, 1]]),
+        ('repeated key', [[next_key, 1, 1, 1, 1], [next_key, 2, 2, 2, 2]]),
+        ('existing key', [[next_key, 1, 1, 1, 1], [0, 2, 2, 2, 2]]),
+    ]
+    for label, rows in bad_batches:
+        if query.insert_many(rows) is not False:
+            print(name, 'insert_many error: batch with', label, 'accepted')
+    # Single inserts still write every column in step, and the keys of the rejected batches are still free
+    if not query.insert(next_key + 2, 3, 3, 3, 3):
+        print(name, 'insert error after rejected batches')
+    records[next_key + 2] = [next_key + 2, 3, 3, 3, 3]
+    rows = [[next_key, -1, 1 << 62, -(1 << 63), (1 << 63) - 1], [next_key + 1, 0, 0, 0, 0]]
+    if not query.insert_many(rows):
+        print(name, 'insert_many error on keys of rejected batches')
+    for row in rows:
+        records[row[0]] = row
+    check(query, records, name + ' insert')
+
+    # Each of these must be rejected before anything is updated, keys before the bad one included
+    bad_batches = [
+        ('missing key', [1, 2 * number_of_records], [[None, 5, None, None, None]] * 2),
+        ('repeated key', [1, 2, 1], [[None, 5, None, None, None]] * 3),
+        ('fewer column lists than keys', [1, 2], [[None, 5, None, None, None]]),
+        ('short column list', [1, 2], [[None, 5, None, None, None], [None, 5, None, None]]),
+        ('key column update', [1, 2], [[None, 5, None, None, None], [7, 5, None, None, None]]),
+        ('string value', [1, 2], [[None, 5, None, None, None], [None, 'x', None, None, None]]),
+        ('float value', [1, 2], [[None, 5, None, None, None], [None, 0.5, None, None, None]]),
+        ('value over 64 bits', [1, 2], [[None, 5, None, None, None], [None, -(1 << 63) - 1, None, None, None]]),
+    ]
+    for label, keys, column_values in bad_batches:
+        if query.update_many(keys, column_values) is not False:
+            print(name, 'update_many error: batch with', label, 'accepted')
+    if not query.update_many([1, 2], [[None, 5, None, None, None], [None, None, None, None, 6]]):
+        print(name, 'update_many error after rejected batches')
+    records[1][1] = 5
+    records[2][4] = 6
+
+    # Enough batches for merges of every page range, which the rejected batches must not hold back
+    for _ in range(number_of_update_batches):
+        keys = sample(range(number_of_records), batch_size)
+        column_values = []
+        for key in keys:
+            columns = [None, None, None, None, None]
+            for column in sample(range(1, 5), randint(1, 4)):
+                columns[column] = randint(0, 20)
+            column_values.append(columns)
+        if not query.update_many(keys, column_values):
+            print(name, 'update_many error')
+        for key, columns in zip(keys, column_values):
+            records[key] = [old if new is None else new for old, new in zip(records[key], columns)]
+    table.wait_for_merge()
+    stats = table.merge_stats()
+    if not stats['records_consolidated'] or stats['failed']:
+        print(name, 'merge error:', stats['records_consolidated'], 'records consolidated,', stats['failed'], 'failed')
+    check(query, records, name + ' update')
+db.close()
+print("Bulk finished")
+
+db = Database()
+db.open('./ECS165_bulk')
+for name, records in all_records.items():
+    query = Query(db.get_table(name))
+    check(query, records, name + ' reopen')
+    if not query.update_many([1], [[None, 7, 7, 7, 7]]):
+        print(name, 'update_many error after reopen')
+    records[1] = [1, 7, 7, 7, 7]
+    check(query, records, name + ' reopen update')
+db.close()
+print("Reopen finished")
@@ -0,0 +1,46 @@
+from lstore.db import Database
+from lstore.query import Query
+from time import process_time
+from random import choice, randrange, seed
+
+# Cumulative vs non-cumulative tail records: update throughput and select latency on a 10 column table
+NUM_COLUMNS = 10
+NUM_RECORDS = 10000
+NUM_UPDATES = 50000
+NUM_SELECTS = 10000
+
+for cumulative in (True, False):
+    seed(3562901)
+    db = Database()
+    table = db.create_table('Grades', NUM_COLUMNS, 0, cumulative=cumulative)
+    query = Query(table)
+    keys = [906659671 + i for i in range(NUM_RECORDS)]
+    query.insert_many([[key] + [0] * (NUM_COLUMNS - 1) for key in keys])
+    mode = "cumulative" if cumulative else "non-cumulative"
+
+    # One column per update, the case cumulative tail records make expensive
+    update_time_0 = process_time()
+    for i in range(NUM_UPDATES):
+        columns = [None] * NUM_COLUMNS
+        columns[randrange(1, NUM_COLUMNS)] = randrange(0, 100)
+        query.update(choice(keys), *columns)
+    update_time_1 = process_time()
+    update_time = update_time_1 - update_time_0
+    print(f"{mode}: updating {NUM_UPDATES // 1000}k records took:  \t\t", update_time,
+          f"\t({NUM_UPDATES / update_time:.0f} updates/s)")
+
+    select_time_0 = process_time()
+    for i in range(NUM_SELECTS):
+        query.select(choice(keys), 0, [1] * NUM_COLUMNS)
+    select_time_1 = process_time()
+    select_time = select_time_1 - select_time_0
+    print(f"{mode}: selecting {NUM_SELECTS // 1000}k records took:  \t\t", select_time,
+          f"\t({select_time / NUM_SELECTS * 1e6:.1f} us/select)")
+
+    # Merged records answer from the base pages in either mode
+    table._merge()
+    select_time_0 = process_time()
+    for i in range(NUM_SELECTS):
+        query.select(choice(keys), 0, [1] * NUM_COLUMNS)
+    select_time_1 = process_time()
+    print(f"{mode}: selecting {NUM_SELECTS // 1000}k records after merge took:\t", select_time_1 - select_time_0)
@@ -0,0 +1,91 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, randrange, sample, seed
+import shutil
+
+# Lazy open: reopens a database with its page files memory-mapped and keeps writing to it through a small
+# BufferPool. Each round inserts into the last page range and updates the new records until a merge rewrites
+# their pages, so evicted pages come back from slots rewritten since the mapping. Finally the database is
+# reopened both ways and eager and lazy opens must read the same records
+number_of_records = 2000
+number_of_updates = 3000
+# Enough updates to one page range to start a merge of it
+number_of_merge_updates = 6000
+number_of_inserts = 300
+number_of_deletes = 60
+capacity = 16
+seed(3562901)
+
+
+def check(query, records, deleted, label):
+    for key, columns in records.items():
+        found = query.select(key, 0, [1, 1, 1, 1, 1])
+        if not found or found[0].columns != columns:
+            print(label, 'select error on', key, ':', found and found[0].columns, ', correct:', columns)
+    for key in deleted:
+        if query.select(key, 0, [1, 1, 1, 1, 1]):
+            print(label, 'deleted record', key, 'still found')
+    for column in range(5):
+        result = query.sum(0, number_of_records + 3 * number_of_inserts - 1, column)
+        correct = sum(columns[column] for columns in records.values())
+        if result != correct:
+            print(label, 'sum error on column', column, ':', result, ', correct:', correct)
+
+
+def update(query, records, count, low=0):
+    for _ in range(count):
+        key = randrange(low, next_key)
+        if key not in records:
+            continue
+        columns = [None, None, None, None, None]
+        for column in sample(range(1, 5), randint(1, 4)):
+            columns[column] = randint(0, 20)
+        query.update(key, *columns)
+        records[key] = [old if new is None else new for old, new in zip(records[key], columns)]
+
+
+shutil.rmtree('./ECS165_lazy', ignore_errors=True)
+db = Database()
+db.open('./ECS165_lazy')
+grades_table = db.create_table('Grades', 5, 0)
+query = Query(grades_table)
+
+records = {}
+deleted = set()
+for key in range(number_of_records):
+    records[key] = [key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]
+    query.insert(*records[key])
+next_key = number_of_records
+update(query, records, number_of_updates)
+db.close()
+print("Create finished")
+
+db = Database(bufferpool_capacity=capacity)
+db.open('./ECS165_lazy', lazy=True)
+query = Query(db.get_table('Grades'))
+check(query, records, deleted, 'lazy open')
+
+# Every checkpoint rewrites slots of the mapped files; later faults must read them from disk, not the mapping
+for _ in range(3):
+    for key in range(next_key, next_key + number_of_inserts):
+        records[key] = [key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]
+        query.insert(*records[key])
+    next_key += number_of_inserts
+    update(query, records, number_of_merge_updates, next_key - number_of_inserts)
+    for key in sample(sorted(records), number_of_deletes):
+        query.delete(key)
+        del records[key]
+        deleted.add(key)
+    db.get_table('Grades').wait_for_merge()
+    db.checkpoint()
+    check(query, records, deleted, 'lazy write')
+db.close()
+print("Lazy write finished")
+
+for lazy in (False, True):
+    db = Database(bufferpool_capacity=capacity)
+    db.open('./ECS165_lazy', lazy=lazy)
+    check(Query(db.get_table('Grades')), records, deleted, 'lazy reopen' if lazy else 'eager reopen')
+    db.close()
+print("Reopen finished")
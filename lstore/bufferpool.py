@@ -1,18 +1,221 @@
 import os
+import mmap
+import threading
+from collections import OrderedDict
+
+# Default page size; each table can choose its own. Each page is stored as its data followed by an 8-byte
+# record count
+PAGE_SIZE = 4096
+
+
+class LRUPolicy:
+    """
+    Evicts the least recently used unpinned frame.
+    """
+
+    def __init__(self, capacity):
+        self.order = OrderedDict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def admit(self, key):
+        self.order[key] = None
+
+    def touch(self, key):
+        if key in self.order:
+            self.order.move_to_end(key)
+
+    def remove(self, key, evicted=False):
+        self.order.pop(key, None)
+
+    def victim(self, evictable):
+        for key in self.order:
+            if evictable(key):
+                return key
+        return None
+
+
+class ClockPolicy:
+    """
+    Second-chance replacement: a clock hand sweeps the frames and evicts the first unpinned frame
+    whose reference bit is already cleared.
+    """
+
+    def __init__(self, capacity):
+        self.frames = []
+        self.referenced = {}
+        self.hand = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def admit(self, key):
+        self.frames.append(key)
+        self.referenced[key] = True
+
+    def touch(self, key):
+        if key in self.referenced:
+            self.referenced[key] = True
+
+    def remove(self, key, evicted=False):
+        if key not in self.referenced:
+            return
+        idx = self.frames.index(key)
+        self.frames.pop(idx)
+        del self.referenced[key]
+        if idx < self.hand:
+            self.hand -= 1
+        if self.hand >= len(self.frames):
+            self.hand = 0
+
+    def victim(self, evictable):
+        # Two full sweeps are enough: the first clears every reference bit
+        for _ in range(2 * len(self.frames)):
+            key = self.frames[self.hand]
+            if evictable(key):
+                if not self.referenced[key]:
+                    return key
+                self.referenced[key] = False
+            self.hand = (self.hand + 1) % len(self.frames)
+        return None
+
+
+class TwoQueuePolicy:
+    """
+    Simplified 2Q: pages seen once live in a FIFO (A1in), pages referenced again after leaving it
+    are promoted to an LRU (Am). A1out remembers recently evicted A1in keys so a quick re-read is
+    recognised as a second reference.
+    """
+
+    def __init__(self, capacity):
+        self.kin = max(1, capacity // 4)
+        self.kout = max(1, capacity // 2)
+        self.a1in = OrderedDict()
+        self.a1out = OrderedDict()
+        self.am = OrderedDict()
+
+    def __len__(self):
+        return len(self.a1in) + len(self.am)
+
+    def admit(self, key):
+        if key in self.a1out:
+            del self.a1out[key]
+            self.am[key] = None
+        else:
+            self.a1in[key] = None
+
+    def touch(self, key):
+        if key in self.am:
+            self.am.move_to_end(key)
+
+    def remove(self, key, evicted=False):
+        if key in self.a1in:
+            del self.a1in[key]
+            if evicted:
+                self.a1out[key] = None
+                if len(self.a1out) > self.kout:
+                    self.a1out.popitem(last=False)
+        else:
+            self.am.pop(key, None)
+
+    def victim(self, evictable):
+        queues = (self.a1in, self.am) if len(self.a1in) > self.kin or not self.am else (self.am, self.a1in)
+        for queue in queues:
+            for key in queue:
+                if evictable(key):
+                    return key
+        return None
+
+
+POLICIES = {
+    'lru': LRUPolicy,
+    'clock': ClockPolicy,
+    '2q': TwoQueuePolicy,
+}
+
 
 class BufferPool:
     """
-    Tracks dirty pages and handles flushing to disk.
+    Owns the in-memory frames of every table page. At most `capacity` pages are resident at a time;
+    when a page is registered or faulted in past that limit, an unpinned victim chosen by the
+    replacement policy is written back (if dirty) and its frame released. Evicted pages fault back in
+    through load_page the next time their data is read.
     """
 
-    def __init__(self, db_path, capacity=1024):
+    def __init__(self, db_path, capacity=1024, policy='lru'):
         self.db_path = db_path
         self.capacity = capacity
         self.page_registry = {}
+        self.table_columns = {}
+        self.table_page_sizes = {}
+        self._files = {}
+        self._mappings = {}
+        self.policy = POLICIES[policy](capacity) if isinstance(policy, str) else policy
+        # Keys whose latest contents have been written to their page file at least once
+        self._persisted = set()
+        # Keys written since their file was mapped; the copy-on-write mapping may hold older contents for them
+        self._remapped = set()
+        self._lock = threading.RLock()
+        # WriteAheadLog synced before any page is written back (set by Database.open)
+        self.wal = None
+        # Pages written back so far, by eviction or checkpoint
+        self.pages_written = 0
+
+    def register_table(self, table_name, total_columns, page_size=PAGE_SIZE):
+        self.table_columns[table_name] = total_columns
+        self.table_page_sizes[table_name] = page_size
+
+    def _slot_size(self, table_name):
+        return self.table_page_sizes.get(table_name, PAGE_SIZE) + 8
 
-    def register_page(self, table_name, page_type, range_idx, col_idx, page):
+    """
+    # persisted=True marks a page whose on-disk slot already holds its contents (e.g. just loaded)
+    """
+    def register_page(self, table_name, page_type, range_idx, col_idx, page, persisted=False):
+        key = (table_name, page_type, range_idx, col_idx)
+        with self._lock:
+            old_page = self.page_registry.get(key)
+            if old_page is not None and old_page is not page:
+                # Replaced (e.g. by a merge): the old page stays readable but no longer owns the frame
+                if old_page.is_resident():
+                    self.policy.remove(key)
+                self._persisted.discard(key)
+            self.page_registry[key] = page
+            page.bufferpool = self
+            page.key = key
+            if persisted:
+                self._persisted.add(key)
+            if page.is_resident() and old_page is not page:
+                self.policy.admit(key)
+                self._evict_over_capacity(protect=key)
+
+    def unregister_page(self, table_name, page_type, range_idx, col_idx):
+        """
+        Releases a page's frame without writing it back, e.g. a garbage collected tail page
+        """
         key = (table_name, page_type, range_idx, col_idx)
-        self.page_registry[key] = page
+        with self._lock:
+            page = self.page_registry.pop(key, None)
+            if page is None:
+                return
+            if page.is_resident():
+                self.policy.remove(key)
+            self._persisted.discard(key)
+            page.bufferpool = None
+
+    def drop_table(self, table_name):
+        with self._lock:
+            for key in [k for k in self.page_registry if k[0] == table_name]:
+                page = self.page_registry.pop(key)
+                if page.is_resident():
+                    self.policy.remove(key)
+                page.bufferpool = None
+                self._persisted.discard(key)
+            for name in [n for n in self._files if n[0] == table_name]:
+                os.close(self._files.pop(name))
+            self.table_columns.pop(table_name, None)
+            self.table_page_sizes.pop(table_name, None)
 
     def mark_dirty(self, table_name, page_type, range_idx, col_idx):
         key = (table_name, page_type, range_idx, col_idx)
@@ -20,34 +223,174 @@ class BufferPool:
             self.page_registry[key].dirty = True
 
     def get_dirty_pages(self):
-        return {k: v for k, v in self.page_registry.items() if v.dirty}
+        with self._lock:
+            return {k: v for k, v in self.page_registry.items() if v.is_resident() and v.dirty}
+
+    def touch_range(self, page_range):
+        """
+        Records an access to every page of a page range for the replacement policy
+        """
+        with self._lock:
+            for page in page_range:
+                # Tail ranges have no page for columns nothing has written yet
+                if page is not None and page.key is not None and page.is_resident():
+                    self.policy.touch(page.key)
+
+    # Pinned pages are never chosen as eviction victims
+    def pin_page(self, page):
+        with self._lock:
+            page.pin_count += 1
+
+    def unpin_page(self, page):
+        with self._lock:
+            page.pin_count = max(0, page.pin_count - 1)
+
+    def fault_in(self, page):
+        """
+        Loads an evicted page back in and returns its data buffer, taken while the pool lock is still held
+        """
+        with self._lock:
+            if not page.is_resident():
+                self.load_page(*page.key, page)
+                if self.page_registry.get(page.key) is page:
+                    self.policy.admit(page.key)
+                    self._evict_over_capacity(protect=page.key)
+            return page.data
+
+    def _evict_over_capacity(self, protect=None):
+        def evictable(key):
+            return key != protect and self.page_registry[key].pin_count == 0
+
+        while len(self.policy) > self.capacity:
+            victim = self.policy.victim(evictable)
+            if victim is None:
+                # Everything else is pinned; run over capacity until pages are unpinned
+                return
+            self._evict(victim)
+
+    def _evict(self, key):
+        page = self.page_registry[key]
+        # A never-written empty page has nothing worth saving (and must not clobber its slot on disk)
+        if page.dirty or (key not in self._persisted and page.num_records):
+            self.flush_page(key, page)
+        self.policy.remove(key, evicted=True)
+        page.data = None
+
+    def _page_offset(self, key):
+        # Pages sit at fixed slots in <table>_<type>_pages.bin: range by range, column by column
+        table_name, page_type, range_idx, col_idx = key
+        return (range_idx * self.table_columns[table_name] + col_idx) * self._slot_size(table_name)
+
+    def _page_file(self, table_name, page_type):
+        name = (table_name, page_type)
+        if name not in self._files:
+            file_path = os.path.join(self.db_path, f"{table_name}_{page_type}_pages.bin")
+            self._files[name] = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._files[name]
+
+    def map_file(self, table_name, page_type):
+        """
+        Memory-maps a page file copy-on-write. load_page then hands out zero-copy views into the mapping,
+        so pages are only read from disk when touched; modified pages still reach the file via flush_page.
+        """
+        name = (table_name, page_type)
+        if name not in self._mappings:
+            fd = self._page_file(table_name, page_type)
+            size = os.fstat(fd).st_size
+            if size == 0:
+                return memoryview(b'')
+            mapped = mmap.mmap(fd, size, access=mmap.ACCESS_COPY)
+            self._mappings[name] = (mapped, memoryview(mapped))
+        return self._mappings[name][1]
 
     # Dirty page to disk
     def flush_page(self, key, page):
         table_name, page_type, range_idx, col_idx = key
-        file_path = os.path.join(
-            self.db_path,
-            f"{table_name}_{page_type}_r{range_idx}_c{col_idx}.bin"
-        )
-        with open(file_path, 'wb') as f:
-            f.write(bytes(page.data))
-            f.write(page.num_records.to_bytes(8, byteorder='little'))
+        if self.wal:
+            self.wal.sync()
+        # Clear the flag before copying so a write racing with the flush leaves the page dirty
         page.dirty = False  # Clean after flush
+        payload = bytes(page.data) + page.num_records.to_bytes(8, byteorder='little')
+        os.pwrite(self._page_file(table_name, page_type), payload, self._page_offset(key))
+        self.pages_written += 1
+        self._persisted.add(key)
+        if (table_name, page_type) in self._mappings:
+            self._remapped.add(key)
+
+    # Flush dirty pages on close()/eviction, only those of table_name if given
+    def flush_all_dirty(self, table_name=None):
+        with self._lock:
+            written = 0
+            for key, page in list(self.page_registry.items()):
+                if table_name is not None and key[0] != table_name:
+                    continue
+                if page.is_resident() and (page.dirty or key not in self._persisted):
+                    self.flush_page(key, page)
+                    written += 1
+            return written
+
+    def truncate(self, table_name, page_type, num_ranges):
+        """
+        Cuts a page file down to num_ranges page ranges, dropping slots freed by compaction
+        """
+        with self._lock:
+            fd = self._page_file(table_name, page_type)
+            size = num_ranges * self.table_columns[table_name] * self._slot_size(table_name)
+            if os.fstat(fd).st_size > size:
+                os.ftruncate(fd, size)
 
-    # Flush dirty pages on close()/eviction
-    def flush_all_dirty(self):
-        for key, page in list(self.page_registry.items()):
-            if page.dirty:
-                self.flush_page(key, page)
+    def checkpoint(self):
+        """
+        Writes every dirty (or never persisted) page to its slot and fsyncs the page files.
+        Returns the number of pages written. This also writes pages that writers still have pinned, so it is
+        only safe while no table is being changed; Database.checkpoint flushes each table under its lock.
+        """
+        with self._lock:
+            written = self.flush_all_dirty()
+            self.sync()
+            return written
 
-    # Load data from disk
+    def sync(self):
+        """
+        fsyncs the page files, making every page written to them so far durable
+        """
+        with self._lock:
+            for fd in self._files.values():
+                os.fsync(fd)
+
+    def close(self):
+        with self._lock:
+            for page in self.page_registry.values():
+                if isinstance(page._data, memoryview):
+                    page.data = None
+            for mapped, view in self._mappings.values():
+                try:
+                    view.release()
+                    mapped.close()
+                except BufferError:
+                    # A view is still referenced somewhere; the mapping is released once it is collected
+                    pass
+            self._mappings = {}
+            self._remapped = set()
+            for fd in self._files.values():
+                os.close(fd)
+            self._files = {}
+
+    # Load data from disk. The page's in-memory record count is authoritative and left alone: it may be ahead
+    # of the copy on disk, and writers bump it under their table's lock, not this one
     def load_page(self, table_name, page_type, range_idx, col_idx, page):
-        file_path = os.path.join(
-            self.db_path,
-            f"{table_name}_{page_type}_r{range_idx}_c{col_idx}.bin"
-        )
-        if os.path.exists(file_path):
-            with open(file_path, 'rb') as f:
-                page.data = bytearray(f.read(4096))
-                page.num_records = int.from_bytes(f.read(8), byteorder='little')
-            page.dirty = False
\ No newline at end of file
+        key = (table_name, page_type, range_idx, col_idx)
+        offset = self._page_offset(key)
+        slot_size = self._slot_size(table_name)
+        page_size = slot_size - 8
+        mapping = self._mappings.get((table_name, page_type))
+        if mapping is not None and offset + slot_size <= len(mapping[0]) and key not in self._remapped:
+            page.data = mapping[1][offset:offset + page_size]
+            page.dirty = False
+            return
+        payload = os.pread(self._page_file(table_name, page_type), page_size, offset)
+        if len(payload) == page_size:
+            page.data = bytearray(payload)
+        else:
+            page.data = bytearray(page_size)
+        page.dirty = False
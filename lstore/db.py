@@ -1,34 +1,135 @@
 import os
-import io
 import json
-from lstore.table import Table
+import struct
+from lstore.table import Table, RID_COLUMN
 from lstore.page import Page
-from lstore.bufferpool import BufferPool
+from lstore.bufferpool import BufferPool, PAGE_SIZE
+from lstore.page_directory import PageDirectory
+from lstore.wal import WriteAheadLog, LOG_INSERT, LOG_UPDATE, LOG_DELETE, LOG_COMMIT, LOG_ABORT, \
+    LOG_CREATE_TABLE, LOG_DROP_TABLE, LOG_UNDO_INSERT, LOG_UNDO_UPDATE, LOG_UNDO_DELETE
+
+# tables.meta layout: magic, format version, table count, then per table its name, fixed-width fields, the tps
+# of each base range and a bitmap per tail range of the user columns whose tail page exists.
+# Each table's page directory lives next to it in <name>_directory.bin
+CATALOG_MAGIC = b'LSTM'
+CATALOG_VERSION = 4
+CATALOG_HEADER = struct.Struct('<4sII')
+# Version 1 tables lack the trailing cumulative flag (their tail records are cumulative) and versions before 4
+# the page size (PAGE_SIZE)
+TABLE_HEADER_V1 = struct.Struct('<qqqqq')
+TABLE_HEADER_V2 = struct.Struct('<qqqqqq')
+TABLE_HEADER = struct.Struct('<qqqqqqq')
+
+
+def _mask_bytes(num_columns):
+    return (num_columns + 7) // 8
+
+
+def _write_catalog(meta_path, table_metas):
+    with open(meta_path, 'wb') as f:
+        f.write(CATALOG_HEADER.pack(CATALOG_MAGIC, CATALOG_VERSION, len(table_metas)))
+        for meta in table_metas:
+            name = meta['name'].encode('utf-8')
+            f.write(struct.pack('<H', len(name)) + name)
+            f.write(TABLE_HEADER.pack(meta['num_columns'], meta['key'], meta['next_rid'],
+                                      meta['num_base_ranges'], meta['num_tail_ranges'], int(meta['cumulative']),
+                                      meta['page_size']))
+            f.write(struct.pack(f"<{meta['num_base_ranges']}q", *meta['tps']))
+            for mask in meta['tail_columns']:
+                f.write(mask.to_bytes(_mask_bytes(meta['num_columns']), byteorder='little'))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_catalog(meta_path):
+    with open(meta_path, 'rb') as f:
+        raw = f.read()
+
+    if not raw.startswith(CATALOG_MAGIC):
+        # Databases written before the binary catalog keep everything, directory included, in JSON
+        table_metas = json.loads(raw.decode('utf-8'))
+        for m in table_metas:
+            m['page_directory'] = {int(k): tuple(v) for k, v in m['page_directory'].items()}
+            m['tps'] = [0] * m['num_base_ranges']
+            m['cumulative'] = True
+            m['tail_columns'] = None
+            m['page_size'] = PAGE_SIZE
+        return table_metas
+
+    _, version, num_tables = CATALOG_HEADER.unpack_from(raw, 0)
+    table_header = TABLE_HEADER if version >= 4 else TABLE_HEADER_V2 if version >= 2 else TABLE_HEADER_V1
+    pos = CATALOG_HEADER.size
+    table_metas = []
+    for _ in range(num_tables):
+        (name_len,) = struct.unpack_from('<H', raw, pos)
+        pos += 2
+        name = raw[pos:pos + name_len].decode('utf-8')
+        pos += name_len
+        num_columns, key, next_rid, num_base_ranges, num_tail_ranges, *flags = table_header.unpack_from(raw, pos)
+        pos += table_header.size
+        tps = list(struct.unpack_from(f'<{num_base_ranges}q', raw, pos))
+        pos += 8 * num_base_ranges
+        # Before version 3 every tail range had all of its column pages
+        tail_columns = None
+        if version >= 3:
+            width = _mask_bytes(num_columns)
+            tail_columns = [int.from_bytes(raw[pos + i * width:pos + (i + 1) * width], byteorder='little')
+                            for i in range(num_tail_ranges)]
+            pos += width * num_tail_ranges
+        table_metas.append({
+            'name': name,
+            'num_columns': num_columns,
+            'key': key,
+            'next_rid': next_rid,
+            'num_base_ranges': num_base_ranges,
+            'num_tail_ranges': num_tail_ranges,
+            'tps': tps,
+            'cumulative': bool(flags[0]) if flags else True,
+            'tail_columns': tail_columns,
+            'page_size': flags[1] if len(flags) > 1 else PAGE_SIZE,
+        })
+    return table_metas
+
 
 class Database():
 
-    def __init__(self):
+    """
+    :param bufferpool_capacity: int     #Maximum number of pages held in memory once the database is opened
+    :param replacement_policy: string   #BufferPool eviction policy: 'lru', 'clock' or '2q'
+    :param version_retention: int       #Older versions each table keeps per record; None keeps all and disables tail GC
+    :param commit_batch_size: int       #Commits a group commit waits for before flushing the log
+    :param commit_wait: float           #Seconds a group commit waits for its batch to fill, 0 to flush right away
+    :param max_concurrent_merges: int   #Background merges each table may run at once
+    :param merge_pages_per_second: int  #Merge I/O budget per table in pages per second, None for unlimited
+    """
+    def __init__(self, bufferpool_capacity=1024, replacement_policy='lru', version_retention=None,
+                 commit_batch_size=64, commit_wait=0.0, max_concurrent_merges=1, merge_pages_per_second=None):
         self.tables = {}
         self.path = None
         self.bufferpool = None
+        self.wal = None
+        self.bufferpool_capacity = bufferpool_capacity
+        self.replacement_policy = replacement_policy
+        self.version_retention = version_retention
+        self.commit_batch_size = commit_batch_size
+        self.commit_wait = commit_wait
+        self.max_concurrent_merges = max_concurrent_merges
+        self.merge_pages_per_second = merge_pages_per_second
 
-    def open(self, path):
+    """
+    # Opens (or creates) the database stored under path
+    # :param lazy: bool     #Memory-map the page files instead of reading them; pages are faulted in when first touched
+    """
+    def open(self, path, lazy=False):
         self.path = path
         os.makedirs(path, exist_ok=True)
-        self.bufferpool = BufferPool(path)
+        self.bufferpool = BufferPool(path, self.bufferpool_capacity, self.replacement_policy)
+        self.wal = WriteAheadLog(os.path.join(path, 'wal.log'), self.commit_batch_size, self.commit_wait)
+        # No page may reach disk ahead of the log records describing it
+        self.bufferpool.wal = self.wal
 
         meta_path = os.path.join(path, 'tables.meta')
-        if not os.path.exists(meta_path):
-            return
-
-        with io.open(meta_path, 'r', encoding='utf-8') as f:
-            raw = json.load(f)
-
-        table_metas = []
-        for m in raw:
-            m['page_directory'] = {int(k): tuple(v) for k, v in m['page_directory'].items()}
-            table_metas.append(m)
-
+        table_metas = _read_catalog(meta_path) if os.path.exists(meta_path) else []
 
         for meta in table_metas:
             name = meta['name']
@@ -36,110 +137,285 @@ class Database():
             key = meta['key']
             next_rid = meta['next_rid']
 
-            table = Table(name, num_columns, key, self.bufferpool)  # pass bufferpool
+            table = self._new_table(name, num_columns, key, meta['cumulative'], meta['page_size'])  # pass bufferpool
             table.next_rid = next_rid
-            table.page_directory = meta['page_directory']
-
-            total_columns = 5 + num_columns
-
-            # Load base pages
-            base_pages_path = os.path.join(path, f'{name}_base_pages.bin')
-            num_base_ranges = meta['num_base_ranges']
-            table.base_pages = []
-            with open(base_pages_path, 'rb') as f:
-                for range_idx in range(num_base_ranges):
-                    page_range = []
-                    for col_idx in range(total_columns):
-                        page = Page()
-                        page.data = bytearray(f.read(4096))
-                        page.num_records = int.from_bytes(f.read(8), byteorder='little')
-                        page.dirty = False  # just loaded from disk, clean
-                        page_range.append(page)
-                        self.bufferpool.register_page(name, 'base', range_idx, col_idx, page)
-                    table.base_pages.append(page_range)
-
-            # Load tail pages
-            tail_pages_path = os.path.join(path, f'{name}_tail_pages.bin')
-            num_tail_ranges = meta['num_tail_ranges']
-            table.tail_pages = []
-            with open(tail_pages_path, 'rb') as f:
-                for range_idx in range(num_tail_ranges):
-                    page_range = []
-                    for col_idx in range(total_columns):
-                        page = Page()
-                        page.data = bytearray(f.read(4096))
-                        page.num_records = int.from_bytes(f.read(8), byteorder='little')
-                        page.dirty = False  # just loaded from disk, clean
-                        page_range.append(page)
-                        self.bufferpool.register_page(name, 'tail', range_idx, col_idx, page)
-                    table.tail_pages.append(page_range)
+            if 'page_directory' in meta:
+                table.page_directory = PageDirectory.from_dict(meta['page_directory'])
+            else:
+                table.page_directory = PageDirectory.load(os.path.join(path, f'{name}_directory.bin'), next_rid)
+
+            table.base_pages = self._load_pages(table, 'base', meta['num_base_ranges'], lazy)
+            table.tail_pages = self._load_pages(table, 'tail', meta['num_tail_ranges'], lazy, meta['tail_columns'])
+            table.tps = meta['tps']
+            table._tail_records_since_merge = [0] * len(table.base_pages)
+            table.tail_lineage = None
+            self.tables[name] = table
+
+        recovered = self._recover()
 
+        for table in self.tables.values():
             # Rebuild indexes from loaded data
-            table.index.indices = [None] * num_columns
-            table.index.create_index(key)
+            table.index.indices = [None] * table.num_columns
+            if lazy:
+                table.index.defer_index(table.key)
+            else:
+                table.index.create_index(table.key)
 
-            self.tables[name] = table
+        if recovered:
+            # Makes the recovered state the new starting point and empties the log
+            self.checkpoint()
 
+    def _recover(self):
+        """
+        Brings the tables loaded from the last checkpoint up to date from the log: every logged change is
+        redone in order (including the undo records of rollbacks), then the changes of transactions with
+        neither COMMIT nor ABORT are undone newest first. Returns True if the log held anything.
+        """
+        records = self.wal.records()
+        finished = {txn_id for record_type, txn_id, _ in records if record_type in (LOG_COMMIT, LOG_ABORT)}
 
-    def close(self):
+        for record_type, txn_id, fields in records:
+            if record_type == LOG_CREATE_TABLE:
+                name, num_columns, key = fields[:3]
+                cumulative = bool(fields[3]) if len(fields) > 3 else True
+                page_size = fields[4] if len(fields) > 4 else PAGE_SIZE
+                if name not in self.tables:
+                    self.tables[name] = self._new_table(name, num_columns, key, cumulative, page_size)
+                continue
+            if record_type == LOG_DROP_TABLE:
+                self.tables.pop(fields[0], None)
+                self.bufferpool.drop_table(fields[0])
+                continue
+            if fields is None or fields[0] not in self.tables:
+                continue
+            table = self.tables[fields[0]]
+            if record_type == LOG_INSERT:
+                rid, range_idx, offset = fields[1:4]
+                table._redo_record('base', range_idx, offset, fields[4:])
+            elif record_type == LOG_UPDATE:
+                tail_rid, tail_range, tail_offset, base_range, base_offset, _ = fields[1:7]
+                table._redo_record('tail', tail_range, tail_offset, fields[7:])
+                table._redo_indirection(base_range, base_offset, tail_rid)
+            elif record_type == LOG_DELETE:
+                if fields[1] in table.page_directory:
+                    del table.page_directory[fields[1]]
+            elif record_type == LOG_UNDO_INSERT:
+                table._undo_insert(fields[1])
+            elif record_type == LOG_UNDO_UPDATE:
+                table._undo_update(*fields[1:5])
+            elif record_type == LOG_UNDO_DELETE:
+                table._undo_delete(fields[1])
+
+        for record_type, txn_id, fields in reversed(records):
+            if txn_id == 0 or txn_id in finished or fields is None or fields[0] not in self.tables:
+                continue
+            table = self.tables[fields[0]]
+            # A loser interrupted while rolling back may already have undone some of these; undo is idempotent
+            if record_type == LOG_INSERT:
+                table._undo_insert(fields[1])
+            elif record_type == LOG_UPDATE:
+                tail_rid, _, _, base_range, base_offset, prev_indirection = fields[1:7]
+                table._undo_update(tail_rid, base_range, base_offset, prev_indirection)
+            elif record_type == LOG_DELETE:
+                table._undo_delete(fields[1])
+
+        return bool(records) or os.path.getsize(self.wal.file_path) > 0
+
+    def _load_pages(self, table, page_type, num_ranges, lazy, column_masks=None):
+        """
+        column_masks: per range, the user columns that have a page (see Table.tail_column_masks); None if all do.
+        Missing pages are left as None and their slots in the page file are skipped.
+        """
+        total_columns = 5 + table.num_columns
+        page_size = table.page_size
+        slot_size = page_size + 8
+        pages_path = os.path.join(self.path, f'{table.name}_{page_type}_pages.bin')
+        page_ranges = []
+
+        def allocated(range_idx, col_idx):
+            return column_masks is None or col_idx < 5 or (column_masks[range_idx] >> (col_idx - 5)) & 1
+
+        if lazy:
+            # Only the record count of each range is read here; every column page of a range holds the
+            # same number of records, so the RID column's count stands in for the whole range
+            mapping = self.bufferpool.map_file(table.name, page_type)
+            for range_idx in range(num_ranges):
+                offset = (range_idx * total_columns + RID_COLUMN) * slot_size + page_size
+                num_records = int.from_bytes(mapping[offset:offset + 8], byteorder='little')
+                page_range = []
+                for col_idx in range(total_columns):
+                    if not allocated(range_idx, col_idx):
+                        page_range.append(None)
+                        continue
+                    page = Page(resident=False, size=page_size)
+                    page.num_records = num_records
+                    page_range.append(page)
+                    self.bufferpool.register_page(table.name, page_type, range_idx, col_idx, page, persisted=True)
+                page_ranges.append(page_range)
+            return page_ranges
+
+        with open(pages_path, 'rb') as f:
+            for range_idx in range(num_ranges):
+                page_range = []
+                for col_idx in range(total_columns):
+                    if not allocated(range_idx, col_idx):
+                        f.seek(slot_size, os.SEEK_CUR)
+                        page_range.append(None)
+                        continue
+                    page = Page(size=page_size)
+                    page.data = bytearray(f.read(page_size))
+                    page.num_records = int.from_bytes(f.read(8), byteorder='little')
+                    page.dirty = False  # just loaded from disk, clean
+                    page_range.append(page)
+                    self.bufferpool.register_page(table.name, page_type, range_idx, col_idx, page, persisted=True)
+                page_ranges.append(page_range)
+        return page_ranges
+
+    """
+    # Writes the database to disk while it stays open
+    # Only dirty pages are written, each to its fixed slot in <name>_base_pages.bin / <name>_tail_pages.bin,
+    # and only the changed blocks of each <name>_directory.bin, so the I/O is proportional to what changed since
+    # the last checkpoint
+    # :param full: bool     #Rewrite every page, evicted ones included, and every directory in full
+    # Returns the number of pages written
+    """
+    def checkpoint(self, full=False):
         if self.path is None:
-            return
+            return 0
 
         os.makedirs(self.path, exist_ok=True)
         table_metas = []
+        # Every change logged before this point is captured by the pages and directories written below
+        log_position = self.wal.mark()
+        pages_written = self.bufferpool.pages_written
 
         for name, table in self.tables.items():
+            if full:
+                for page_range in table.base_pages + table.tail_pages:
+                    for page in page_range or ():
+                        if page is None:
+                            continue
+                        # An evicted page is faulted back in (pinned until marked dirty, so eviction writes
+                        # it out rather than dropping it)
+                        table._pin_range([page])
+                        if page.data is not None:
+                            page.dirty = True
+                        table._unpin_range([page])
 
-            # Only write pages that are dirty
-            base_pages_path = os.path.join(self.path, f'{name}_base_pages.bin')
-            with open(base_pages_path, 'wb') as f:
-                for page_range in table.base_pages:
-                    for page in page_range:
-                        f.write(bytes(page.data))
-                        f.write(page.num_records.to_bytes(8, byteorder='little'))
-                        page.dirty = False
-
-            tail_pages_path = os.path.join(self.path, f'{name}_tail_pages.bin')
-            with open(tail_pages_path, 'wb') as f:
-                for page_range in table.tail_pages:
-                    for page in page_range:
-                        f.write(bytes(page.data))
-                        f.write(page.num_records.to_bytes(8, byteorder='little'))
-                        page.dirty = False
+            directory_path = os.path.join(self.path, f'{name}_directory.bin')
+            with table._table_lock:
+                next_rid = table.next_rid
+                # Only the directory blocks changed since the last checkpoint are rewritten, in place; a torn
+                # write is repaired by redo like a torn page. A new table's directory is written out whole
+                rewrite = full or not table.page_directory.on_disk or not os.path.exists(directory_path)
+                if rewrite:
+                    page_directory = table.page_directory.copy()
+                    table.page_directory.dirty_blocks = set()
+                    table.page_directory.on_disk = True
+                else:
+                    changes = table.page_directory.take_changes(next_rid)
+                tps = list(table.tps)
+                num_base_ranges = len(table.base_pages)
+                num_tail_ranges = len(table.tail_pages)
+            tail_columns = table.tail_column_masks()
+
+            try:
+                if rewrite:
+                    page_directory.save(directory_path + '.tmp', next_rid)
+                    os.replace(directory_path + '.tmp', directory_path)
+                else:
+                    PageDirectory.save_changes(directory_path, changes, next_rid)
+            except BaseException:
+                with table._table_lock:
+                    if rewrite:
+                        table.page_directory.on_disk = False
+                    else:
+                        table.page_directory.mark_changed(changes)
+                raise
 
             table_metas.append({
                 'name': name,
                 'num_columns': table.num_columns,
                 'key': table.key,
-                'next_rid': table.next_rid,
-                'page_directory': table.page_directory,
-                'num_base_ranges': len(table.base_pages),
-                'num_tail_ranges': len(table.tail_pages),
+                'next_rid': next_rid,
+                'num_base_ranges': num_base_ranges,
+                'num_tail_ranges': num_tail_ranges,
+                'tps': tps,
+                'cumulative': table.cumulative,
+                'tail_columns': tail_columns,
+                'page_size': table.page_size,
             })
 
+            # Slots past the last tail range were freed by compact_tail_pages. Holding the table lock keeps a
+            # tail range allocated meanwhile from being flushed past the cut. The table's pages are written
+            # under the same lock: a writer holds it from changing a reachable page until the change is logged,
+            # so no page reaches disk ahead of its log record (the log before the mark is truncated below)
+            with table._table_lock:
+                self.bufferpool.truncate(name, 'tail', len(table.tail_pages))
+                self.bufferpool.flush_all_dirty(name)
+
+        self.bufferpool.sync()
+        # Includes pages a full checkpoint had evicted while marking them dirty
+        written = self.bufferpool.pages_written - pages_written
+
+        # Replace the metadata atomically so a crash mid-write leaves the previous checkpoint intact
         meta_path = os.path.join(self.path, 'tables.meta')
-        with io.open(meta_path, 'w', encoding='utf-8') as f:
-            json.dump(table_metas,f)
+        _write_catalog(meta_path + '.tmp', table_metas)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.wal.truncate(log_position)
+        return written
+
+    def close(self):
+        if self.path is None:
+            return
+
+        for table in self.tables.values():
+            table.wait_for_merge()
+            table.compact_tail_pages()
+        self.checkpoint()
+        self.bufferpool.close()
+        self.wal.close()
+
+    """
+    # Commit latency percentiles and group commit batch sizes, see WriteAheadLog.commit_stats
+    """
+    def commit_stats(self):
+        if self.wal is None:
+            return None
+        return self.wal.commit_stats()
 
     """
     # Creates a new table
     :param name: string         #Table name
     :param num_columns: int     #Number of Columns: all columns are integer
     :param key: int             #Index of table key in columns
+    :param cumulative: bool     #Tail records repeat every column; False stores only the updated ones
+    :param page_size: int       #Bytes per page (a multiple of 8), e.g. 64 KB-1 MB for scan-heavy tables
     """
-    def create_table(self, name, num_columns, key_index):
+    def create_table(self, name, num_columns, key_index, cumulative=True, page_size=PAGE_SIZE):
         if name in self.tables:
             return self.tables[name]
-        table = Table(name, num_columns, key_index, self.bufferpool)
+        table = self._new_table(name, num_columns, key_index, cumulative, page_size)
         self.tables[name] = table
+        if self.wal:
+            self.wal.log_create_table(name, num_columns, key_index, cumulative, page_size)
         return table
 
+    # A Table sharing this database's BufferPool, log and per-table settings
+    def _new_table(self, name, num_columns, key, cumulative, page_size):
+        return Table(name, num_columns, key, self.bufferpool, self.version_retention, self.wal, cumulative,
+                     page_size, self.max_concurrent_merges, self.merge_pages_per_second)
+
     """
     # Deletes the specified table
     """
     def drop_table(self, name):
         if name in self.tables:
             del self.tables[name]
+            if self.wal:
+                self.wal.log_drop_table(name)
+            if self.bufferpool:
+                self.bufferpool.drop_table(name)
 
     """
     # Returns table with the passed name
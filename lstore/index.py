@@ -10,21 +10,44 @@ class Index:
         self.table = table
         self.indices = [None] *  table.num_columns
         self._index_lock = threading.Lock()
+        self._deferred = set()
+        self._deferred_lock = threading.RLock()
         self.create_index(self.table.key)
 
+    """
+    # Marks a column to be indexed on first use instead of now (used when a database is opened lazily)
+    """
+    def defer_index(self, column_number):
+        self._deferred.add(column_number)
+
+    def _build_deferred(self):
+        if not self._deferred:
+            return
+        with self._deferred_lock:
+            while self._deferred:
+                column_number = min(self._deferred)
+                self.create_index(column_number)
+                self._deferred.discard(column_number)
+
     """
     # returns the location of all records with the given value on column "column"
     """
     def locate(self, column, value):
+        self._build_deferred()
         with self._index_lock:
             if self.indices[column] is None or value not in self.indices[column]:
                 return []
             return list(self.indices[column].get(value, []))
 
+    def has_index(self, column):
+        self._build_deferred()
+        return self.indices[column] is not None
+
     """
     # Returns the RIDs of all records with values in column "column" between "begin" and "end"
     """
     def locate_range(self, begin, end, column):
+        self._build_deferred()
         with self._index_lock:
             search_results = []
             if self.indices[column] is None:
@@ -62,6 +85,7 @@ class Index:
             self.indices[column_number] = None
 
     def insert_key(self, value, rid):
+        self._build_deferred()
         with self._index_lock:
             column = self.table.key
             if self.indices[column] is None:
@@ -71,7 +95,86 @@ class Index:
             self.indices[column][value].append(rid)
 
     def remove_key(self, column, value, rid):
+        self._build_deferred()
         with self._index_lock:
             if self.indices[column] and value in self.indices[column]:
                 if rid in self.indices[column][value]:
-                    self.indices[column][value].remove(rid)
\ No newline at end of file
+                    self.indices[column][value].remove(rid)
+                if not self.indices[column][value]:
+                    del self.indices[column][value]
+
+    """
+    # Returns the values among "values" that are already keys of the primary key index, checked in one pass
+    """
+    def existing_keys(self, values):
+        self._build_deferred()
+        with self._index_lock:
+            tree = self.indices[self.table.key]
+            if tree is None:
+                return []
+            return [value for value in values if value in tree]
+
+    """
+    # Bulk version of insert_key + insert_record: indexes new records (rows[i] has RID rids[i]) under one lock
+    """
+    def insert_records(self, rows, rids):
+        self._build_deferred()
+        with self._index_lock:
+            for column, tree in enumerate(self.indices):
+                if tree is None:
+                    continue
+                entries = {}
+                for row, rid in zip(rows, rids):
+                    entries.setdefault(row[column], []).append(rid)
+                for value, value_rids in entries.items():
+                    existing = tree.get(value)
+                    if existing is None:
+                        tree[value] = value_rids
+                    else:
+                        existing.extend(rid for rid in value_rids if rid not in existing)
+
+    """
+    # Bulk update_key: moves many records' entries in the index of "column", changes being (old_value, new_value,
+    # rid); the RID list of each affected value is rewritten once
+    """
+    def update_keys(self, column, changes):
+        self._build_deferred()
+        with self._index_lock:
+            tree = self.indices[column]
+            if tree is None:
+                return
+            removed = {}
+            added = {}
+            for old_value, new_value, rid in changes:
+                removed.setdefault(old_value, set()).add(rid)
+                added.setdefault(new_value, []).append(rid)
+            for value, rids in removed.items():
+                if value in tree:
+                    remaining = [rid for rid in tree[value] if rid not in rids]
+                    if remaining:
+                        tree[value] = remaining
+                    else:
+                        del tree[value]
+            for value, rids in added.items():
+                existing = tree.get(value)
+                if existing is None:
+                    tree[value] = rids
+                else:
+                    present = set(existing)
+                    existing.extend(rid for rid in rids if rid not in present)
+
+    """
+    # Adds a newly inserted record to every secondary (non-key) index
+    """
+    def insert_record(self, columns, rid):
+        self._build_deferred()
+        for column, value in enumerate(columns):
+            if column != self.table.key and self.indices[column] is not None:
+                self.add_to_index(column, value, rid)
+
+    """
+    # Moves a record's entry in the index of "column" from old_value to new_value
+    """
+    def update_key(self, column, old_value, new_value, rid):
+        self.remove_key(column, old_value, rid)
+        self.add_to_index(column, new_value, rid)
\ No newline at end of file
@@ -1,70 +1,118 @@
 from lstore.index import Index
 import threading
+from time import monotonic
+
+# Seconds a transaction waits for a record lock before giving up
+LOCK_TIMEOUT = 1.0
+# The lock table is split into this many independently locked stripes by record id
+LOCK_STRIPES = 64
+
+
+class RecordLock:
+    """
+    Shared/exclusive lock on one record: the transactions holding it and how many are waiting for it
+    """
 
-class RWLock:
     def __init__(self):
-        self.lock = threading.Lock()
-        self.reader = 0
-        self.writer = False 
-        
-    def acquire_rlock(self):         
-        with self.lock:
-            if self.writer: return False
-            self.reader += 1
-            return True
-
-    def release_rlock(self):
-        with self.lock:
-            self.reader -= 1
-
-    def acquire_wlock(self):
-        with self.lock:
-            if self.reader or self.writer: return False
-            self.writer = True
-            return True
-
-    def release_wlock(self):
-        with self.lock:
-            self.writer = False
-
-    def upgrade_to_wlock(self):
-        with self.lock:
-            if self.reader == 1 and not self.writer:
-                self.reader -= 1
-                self.writer = True
-                return True
-            return False
+        self.holders = {}
+        self.waiting = 0
 
+    def grantable(self, transaction, mode):
+        others = [m for t, m in self.holders.items() if t is not transaction]
+        if mode == 'S':
+            return 'X' not in others
+        return not others
+
+
+class LockStripe:
+    """
+    One shard of the lock table: its record locks, the mutex guarding them and a condition waiters sleep on
+    """
 
-class LockManager:
     def __init__(self):
         self.locks = {}
-        self.map_lock = threading.Lock()
+        self.mutex = threading.Lock()
+        self.released = threading.Condition(self.mutex)
+
+
+class LockManager:
+    """
+    Strict 2PL record locks with wait queues. A conflicting request waits (up to timeout seconds) instead of
+    failing right away. Deadlocks are prevented with wait-die: a transaction only waits for younger ones,
+    so the waits-for graph cannot have a cycle; a younger requester dies (the request returns False and
+    the transaction aborts and is retried, keeping its age so it eventually gets through).
+    """
+
+    def __init__(self, timeout=LOCK_TIMEOUT, num_stripes=LOCK_STRIPES):
+        self.timeout = timeout
+        self.stripes = [LockStripe() for _ in range(num_stripes)]
+
+    def _stripe(self, record_id):
+        return self.stripes[self._stripe_index(record_id)]
+
+    def _stripe_index(self, record_id):
+        return hash(record_id) % len(self.stripes)
 
-    def get_lock(self, record_id):
-        with self.map_lock:
-            if record_id not in self.locks:
-                self.locks[record_id] = RWLock()
-            return self.locks[record_id]
+    def __len__(self):
+        # Record locks currently held or waited on; others are reclaimed. An idle LockManager is therefore falsy,
+        # so callers test it against None
+        return sum(len(stripe.locks) for stripe in self.stripes)
+
+    @staticmethod
+    def _age(transaction):
+        # Transactions get their timestamp on their first run; lower is older
+        timestamp = getattr(transaction, 'timestamp', None)
+        return timestamp if timestamp is not None else float('inf')
+
+    def _acquire(self, transaction, record_id, mode):
+        deadline = monotonic() + self.timeout
+        stripe = self._stripe(record_id)
+        with stripe.mutex:
+            lock = stripe.locks.get(record_id)
+            if lock is None:
+                lock = stripe.locks[record_id] = RecordLock()
+            while not lock.grantable(transaction, mode):
+                age = self._age(transaction)
+                # Wait-die: younger than a holder, or out of time
+                remaining = deadline - monotonic()
+                if any(self._age(t) <= age for t in lock.holders if t is not transaction) or remaining <= 0:
+                    if not lock.holders and not lock.waiting:
+                        del stripe.locks[record_id]
+                    return False
+                lock.waiting += 1
+                stripe.released.wait(remaining)
+                lock.waiting -= 1
+            lock.holders[transaction] = mode
+        transaction.held_locks[record_id] = mode
+        return True
 
     def acquire_shared(self, transaction, record_id):
         if transaction.held_locks.get(record_id) in ('X', 'S'): return True
-        if self.get_lock(record_id).acquire_rlock():
-            transaction.held_locks[record_id] = 'S'
-            return True
-        return False
+        return self._acquire(transaction, record_id, 'S')
 
     def acquire_exclusive(self, transaction, record_id):
-        held = transaction.held_locks.get(record_id)
-        if held == 'X': return True
-        lock = self.get_lock(record_id)
-        if held == 'S' and not lock.upgrade_to_wlock(): return False
-        if held != 'S' and not lock.acquire_wlock(): return False
-        transaction.held_locks[record_id] = 'X'
-        return True
+        if transaction.held_locks.get(record_id) == 'X': return True
+        # Also upgrades a shared lock the transaction already holds
+        return self._acquire(transaction, record_id, 'X')
 
     def release_all(self, transaction):
-        for record_id, lock_type in list(transaction.held_locks.items()):
-            lock = self.get_lock(record_id)
-            lock.release_rlock() if lock_type == 'S' else lock.release_wlock()
-        transaction.held_locks.clear()
\ No newline at end of file
+        by_stripe = {}
+        for record_id in transaction.held_locks:
+            by_stripe.setdefault(self._stripe_index(record_id), []).append(record_id)
+        for stripe_index, record_ids in by_stripe.items():
+            stripe = self.stripes[stripe_index]
+            with stripe.mutex:
+                wake = False
+                for record_id in record_ids:
+                    lock = stripe.locks.get(record_id)
+                    if lock is None:
+                        continue
+                    lock.holders.pop(transaction, None)
+                    if lock.waiting:
+                        wake = True
+                    elif not lock.holders:
+                        # Nobody holds or waits on it any more
+                        del stripe.locks[record_id]
+                if wake:
+                    stripe.released.notify_all()
+        transaction.held_locks.clear()
@@ -0,0 +1,133 @@
+"""
+Background merge scheduling. Tables report tail growth per base page range; once a range has accumulated
+enough tail records the scheduler queues it and a bounded pool of worker threads merges it.
+"""
+from collections import deque
+from time import perf_counter, sleep
+import threading
+
+
+class MergeScheduler:
+
+    """
+    :param table: Table                 #Table whose page ranges are merged
+    :param max_concurrent: int          #Maximum number of merges running at once
+    :param max_pages_per_second: int    #Merge I/O budget in pages copied/installed per second, None for unlimited
+    """
+    def __init__(self, table, max_concurrent=1, max_pages_per_second=None):
+        self.table = table
+        self.max_concurrent = max_concurrent
+        self.max_pages_per_second = max_pages_per_second
+
+        self._queue = deque()
+        self._queued = set()
+        self._running = set()
+        self._workers = 0
+        self._cond = threading.Condition()
+
+        self._throttle_lock = threading.Lock()
+        self._tokens = 0.0
+        self._last_refill = perf_counter()
+
+        self.completed = 0
+        self.failed = 0
+        self.gc_failed = 0
+        # Most recent exception raised by a merge or garbage collection run, kept for diagnosis
+        self.last_error = None
+        self.records_consolidated = 0
+        self.tail_ranges_reclaimed = 0
+        self.time_spent = 0.0
+
+    """
+    # Queues a merge of the given base page range. Returns False if it is already queued or running
+    """
+    def request(self, range_idx):
+        with self._cond:
+            if range_idx in self._queued or range_idx in self._running:
+                return False
+            self._queue.append(range_idx)
+            self._queued.add(range_idx)
+            if self._workers < self.max_concurrent:
+                self._workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+            return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                if not self._queue:
+                    self._workers -= 1
+                    self._cond.notify_all()
+                    return
+                range_idx = self._queue.popleft()
+                self._queued.discard(range_idx)
+                self._running.add(range_idx)
+
+            start = perf_counter()
+            consolidated = None
+            reclaimed = 0
+            merge_error = gc_error = None
+            try:
+                consolidated = self.table._merge([range_idx])
+            except Exception as e:
+                merge_error = e
+            # With a bounded version window, tail pages the merge made dead are freed right away
+            if merge_error is None and self.table.version_retention is not None:
+                try:
+                    reclaimed = self.table.collect_garbage()
+                except Exception as e:
+                    gc_error = e
+
+            with self._cond:
+                self._running.discard(range_idx)
+                self.time_spent += perf_counter() - start
+                if merge_error is not None:
+                    self.failed += 1
+                    self.last_error = merge_error
+                else:
+                    self.completed += 1
+                    self.records_consolidated += consolidated
+                if gc_error is not None:
+                    self.gc_failed += 1
+                    self.last_error = gc_error
+                self.tail_ranges_reclaimed += reclaimed
+                self._cond.notify_all()
+
+    """
+    # Blocks until every queued and running merge has finished
+    """
+    def wait(self):
+        with self._cond:
+            while self._queue or self._running:
+                self._cond.wait()
+
+    """
+    # Called by merges before doing I/O on `pages` pages; sleeps as needed to stay within max_pages_per_second
+    """
+    def throttle(self, pages):
+        if not self.max_pages_per_second:
+            return
+        with self._throttle_lock:
+            now = perf_counter()
+            # Allow at most one second worth of burst
+            self._tokens = min(self.max_pages_per_second,
+                               self._tokens + (now - self._last_refill) * self.max_pages_per_second)
+            self._last_refill = now
+            self._tokens -= pages
+            deficit = -self._tokens
+        if deficit > 0:
+            sleep(deficit / self.max_pages_per_second)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running),
+                'completed': self.completed,
+                'failed': self.failed,
+                'gc_failed': self.gc_failed,
+                'last_error': self.last_error,
+                'records_consolidated': self.records_consolidated,
+                'tail_ranges_reclaimed': self.tail_ranges_reclaimed,
+                'time_spent': self.time_spent,
+            }
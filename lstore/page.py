@@ -1,16 +1,55 @@
+from lstore.bufferpool import PAGE_SIZE
+
 
 class Page:
 
-    def __init__(self):
+    """
+    # resident=False creates a page whose contents are still on disk; they are loaded on first access
+    # size is the page size in bytes (a multiple of 8), set per table
+    """
+    def __init__(self, resident=True, size=PAGE_SIZE):
         self.num_records = 0
-        self.data = bytearray(4096)
+        self.size = size
+        self._data = bytearray(size) if resident else None
         self.dirty = False
         self.pin_count = 0
+        # Set by the BufferPool when it takes ownership of this page's frame
+        self.bufferpool = None
+        self.key = None
+
+    @property
+    def data(self):
+        """
+        The page contents. If the BufferPool evicted this page, reading it faults the page back in.
+        """
+        data = self._data
+        if data is None and self.bufferpool is not None:
+            # Reads do not pin the page, so another thread may evict it again right away; keep the buffer
+            # fault_in loaded rather than reading self._data a second time
+            data = self.bufferpool.fault_in(self)
+        return data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def is_resident(self):
+        return self._data is not None
+
+    def copy(self):
+        """
+        Returns a detached in-memory copy of this page (not registered with any BufferPool)
+        """
+        page = Page(size=self.size)
+        page.data = bytearray(self.data)
+        page.num_records = self.num_records
+        page.dirty = True
+        return page
 
     def has_capacity(self):
-        # Each record is 8 bytes (assuming integer size), so we can store 4096 / 8 = 512 records
+        # Each record is 8 bytes (assuming integer size), so a default 4096 byte page stores 4096 / 8 = 512 records
         # Checks if the current number of records is less than the maximum capacity
-        return self.num_records < (len(self.data) // 8)
+        return self.num_records < self.size // 8
 
     def write(self, value):
         """
@@ -21,4 +60,3 @@ class Page:
         offset = (self.num_records - 1) * 8
         self.data[offset:offset + 8] = value.to_bytes(8, byteorder ='little', signed=True)
         self.dirty = True
-
@@ -0,0 +1,188 @@
+"""
+A table's page directory: maps every RID to the location of its record, ('base' | 'tail', page range, offset).
+RIDs are handed out densely by Table.next_rid, so locations are kept in a typed array indexed by RID, one
+packed int64 per record, instead of a dict of tuples. The same array is the on-disk format (<name>_directory.bin).
+Changes are tracked per block of BLOCK_ENTRIES RIDs, so a checkpoint only rewrites the blocks that changed.
+"""
+import os
+import sys
+from array import array
+
+EMPTY = -1
+# RIDs per change-tracking block (4 KB of the directory file)
+BLOCK_ENTRIES = 512
+
+# Packed location layout: bit 0 = tail flag, bits 1-24 = record offset in the page, bits 25+ = page range.
+# A deleted record keeps its location as a tombstone, TOMBSTONE_BASE - packed, so the delete can be undone
+TAIL_FLAG = 1
+OFFSET_BITS = 24
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+RANGE_SHIFT = OFFSET_BITS + 1
+TOMBSTONE_BASE = -2
+
+
+def pack_location(location):
+    record_type, range_idx, offset = location
+    return (range_idx << RANGE_SHIFT) | (offset << 1) | (TAIL_FLAG if record_type == 'tail' else 0)
+
+
+def unpack_location(packed):
+    record_type = 'tail' if packed & TAIL_FLAG else 'base'
+    return (record_type, packed >> RANGE_SHIFT, (packed >> 1) & OFFSET_MASK)
+
+
+class PageDirectory:
+    """
+    Dict-like (rid -> location tuple) view over an array of packed locations. Only live records are
+    visible through `in`, lookups and iteration; deleted ones are tombstoned.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else array('q', [EMPTY])
+        # Blocks changed since the directory was last written, and whether the file holds the rest of it
+        self.dirty_blocks = set()
+        self.on_disk = False
+
+    def __len__(self):
+        return sum(1 for packed in self.entries if packed >= 0)
+
+    def __contains__(self, rid):
+        return 0 <= rid < len(self.entries) and self.entries[rid] >= 0
+
+    def __getitem__(self, rid):
+        if rid not in self:
+            raise KeyError(rid)
+        return unpack_location(self.entries[rid])
+
+    def get(self, rid, default=None):
+        if rid not in self:
+            return default
+        return unpack_location(self.entries[rid])
+
+    def location(self, rid):
+        """
+        Location of rid whether it is live or deleted, None if it never existed
+        """
+        if not 0 <= rid < len(self.entries) or self.entries[rid] == EMPTY:
+            return None
+        packed = self.entries[rid]
+        return unpack_location(packed if packed >= 0 else TOMBSTONE_BASE - packed)
+
+    def __setitem__(self, rid, location):
+        if rid >= len(self.entries):
+            self.entries.extend(array('q', [EMPTY]) * (rid + 1 - len(self.entries)))
+        self.entries[rid] = pack_location(location)
+        self.dirty_blocks.add(rid // BLOCK_ENTRIES)
+
+    def set_block(self, first_rid, location, count):
+        """
+        Points count consecutive RIDs from first_rid at count consecutive slots from location (a bulk insert)
+        """
+        end = first_rid + count
+        if end > len(self.entries):
+            self.entries.extend(array('q', [EMPTY]) * (end - len(self.entries)))
+        packed = pack_location(location)
+        # Offsets sit above the tail flag, so the next slot is two packed units further
+        self.entries[first_rid:end] = array('q', range(packed, packed + 2 * count, 2))
+        self.dirty_blocks.update(range(first_rid // BLOCK_ENTRIES, (end - 1) // BLOCK_ENTRIES + 1))
+
+    def __delitem__(self, rid):
+        if rid not in self:
+            raise KeyError(rid)
+        self.entries[rid] = TOMBSTONE_BASE - self.entries[rid]
+        self.dirty_blocks.add(rid // BLOCK_ENTRIES)
+
+    def restore(self, rid):
+        """
+        Brings a deleted record back at its old location. Returns False if there is no tombstone for rid.
+        """
+        if not 0 <= rid < len(self.entries) or self.entries[rid] > TOMBSTONE_BASE:
+            return False
+        self.entries[rid] = TOMBSTONE_BASE - self.entries[rid]
+        self.dirty_blocks.add(rid // BLOCK_ENTRIES)
+        return True
+
+    def discard(self, rid):
+        """
+        Forgets rid entirely (live or deleted), e.g. once its tail record has been garbage collected
+        """
+        if 0 <= rid < len(self.entries):
+            self.entries[rid] = EMPTY
+            self.dirty_blocks.add(rid // BLOCK_ENTRIES)
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        return (rid for rid, packed in enumerate(self.entries) if packed >= 0)
+
+    def items(self):
+        return ((rid, unpack_location(packed)) for rid, packed in enumerate(self.entries) if packed >= 0)
+
+    def copy(self):
+        return PageDirectory(array('q', self.entries))
+
+    def save(self, file_path, next_rid):
+        entries = array('q', self.entries[:next_rid])
+        entries.extend(array('q', [EMPTY]) * (next_rid - len(entries)))
+        if sys.byteorder == 'big':
+            entries.byteswap()
+        with open(file_path, 'wb') as f:
+            entries.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def take_changes(self, next_rid):
+        """
+        Copies of the blocks changed since the last call, [(first rid, entries)], clipped to next_rid. The
+        blocks count as clean afterwards; pass the copies back to mark_changed if writing them fails.
+        """
+        changes = []
+        for block in sorted(self.dirty_blocks):
+            start = block * BLOCK_ENTRIES
+            end = min(start + BLOCK_ENTRIES, next_rid, len(self.entries))
+            if start < end:
+                changes.append((start, array('q', self.entries[start:end])))
+        self.dirty_blocks = set()
+        return changes
+
+    def mark_changed(self, changes):
+        self.dirty_blocks.update(start // BLOCK_ENTRIES for start, _ in changes)
+
+    @staticmethod
+    def save_changes(file_path, changes, next_rid):
+        """
+        Writes blocks from take_changes in place into a directory file saved earlier, first growing the file
+        to next_rid entries (new RIDs start out EMPTY)
+        """
+        fd = os.open(file_path, os.O_RDWR)
+        try:
+            size = os.fstat(fd).st_size // 8
+            if size < next_rid:
+                padding = array('q', [EMPTY]) * (next_rid - size)
+                os.pwrite(fd, padding.tobytes(), size * 8)
+            for start, entries in changes:
+                if sys.byteorder == 'big':
+                    entries.byteswap()
+                os.pwrite(fd, entries.tobytes(), start * 8)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def load(cls, file_path, next_rid):
+        entries = array('q')
+        with open(file_path, 'rb') as f:
+            entries.fromfile(f, next_rid)
+        if sys.byteorder == 'big':
+            entries.byteswap()
+        directory = cls(entries)
+        directory.on_disk = True
+        return directory
+
+    @classmethod
+    def from_dict(cls, page_directory):
+        directory = cls()
+        for rid, location in page_directory.items():
+            directory[rid] = location
+        return directory
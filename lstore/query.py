@@ -1,4 +1,4 @@
-from lstore.table import Table, Record
+from lstore.table import Table, Record, is_column_value
 from lstore.index import Index
 
 
@@ -14,15 +14,30 @@ class Query:
         self.lock_manager = lock_manager if lock_manager is not None else table.lock_manager
     
     def _acquire_shared(self, transaction, rid):
-        if transaction and self.lock_manager:
+        if transaction and self.lock_manager is not None:
             return self.lock_manager.acquire_shared(transaction, rid)
         return True
     
     def _acquire_exclusive(self, transaction, rid):
-        if transaction and self.lock_manager:
+        if transaction and self.lock_manager is not None:
             return self.lock_manager.acquire_exclusive(transaction, rid)
         return True
 
+    def _snapshot(self, transaction):
+        # Read-only transactions read a snapshot instead of taking locks
+        if transaction is not None and getattr(transaction, 'read_only', False):
+            return transaction.snapshot(self.table)
+        return None
+
+    def _snapshot_records(self, rids, wanted_columns, snapshot):
+        """Helper: yields (rid, column values) for the records among rids that the snapshot sees, records
+        deleted since it was taken included."""
+        projection = [1 if i in wanted_columns else 0 for i in range(self.table.num_columns)]
+        for rid in dict.fromkeys(list(rids) + self.table.deleted_since(snapshot)):
+            data = self.table.get_snapshot_data(rid, projection, snapshot)
+            if data is not None:
+                yield rid, data
+
     """
     # internal Method
     # Read a record with specified RID
@@ -31,6 +46,8 @@ class Query:
     """
     def delete(self, primary_key, transaction = None):
         try:
+            if self._snapshot(transaction) is not None:
+                return False
             rids = self.table.index.locate(self.table.key, primary_key)
             if not rids or len(rids) == 0:
                 return False
@@ -38,7 +55,7 @@ class Query:
             rid = rids[0]
             if not self._acquire_exclusive(transaction, rid):
                 return False
-            return self.table.delete_record(rid)
+            return self.table.delete_record(rid, transaction)
         except Exception:
             return False
 
@@ -51,35 +68,68 @@ class Query:
         schema_encoding = '0' * self.table.num_columns
         
         try:
-            if len(columns) != self.table.num_columns:
+            if len(columns) != self.table.num_columns or self._snapshot(transaction) is not None:
+                return False
+            if not all(is_column_value(value) for value in columns):
                 return False
 
             existing_rids = self.table.index.locate(self.table.key, columns[self.table.key])
             if existing_rids and len(existing_rids) > 0:
                 return False
             
-            rid = self.table.add_base_record(columns, schema_encoding)
+            rid = self.table.add_base_record(columns, schema_encoding, transaction)
 
             if not self._acquire_exclusive(transaction, rid):
-                self.table.delete_record(rid)
+                self.table.delete_record(rid, transaction)
                 return False
             self.table.index.insert_key(columns[self.table.key], rid)
+            self.table.index.insert_record(columns, rid)
             
             return True
         except Exception:
             return False
 
+    """
+    # Insert many records at once; rows is a sequence of column lists
+    # Return True upon succesful insertion of every row
+    # Returns False (inserting nothing) if any row is malformed or its key already exists
+    """
+    def insert_many(self, rows, transaction = None):
+        try:
+            rows = [list(row) for row in rows]
+            if self._snapshot(transaction) is not None:
+                return False
+            if any(len(row) != self.table.num_columns for row in rows):
+                return False
+            if not all(is_column_value(value) for row in rows for value in row):
+                return False
+
+            keys = [row[self.table.key] for row in rows]
+            if len(set(keys)) != len(keys) or self.table.index.existing_keys(keys):
+                return False
+
+            rids = self.table.add_base_records(rows, transaction)
+            for rid in rids:
+                # The transaction rolls the whole batch back if it cannot lock every new record
+                if not self._acquire_exclusive(transaction, rid):
+                    return False
+            self.table.index.insert_records(rows, rids)
+
+            return True
+        except Exception:
+            return False
+
     def _locate_rids(self, search_key, search_key_index):
-        """Helper: locate RIDs by index, falling back to full table scan if no index."""
-        rids = self.table.index.locate(search_key_index, search_key)
-        if not rids:
-            # FIX: full table scan fallback for non-indexed columns
-            rids = []
-            for rid, location in self.table.page_directory.items():
-                if location[0] == 'base':
-                    val = self.table.get_column_value(rid, search_key_index)
-                    if val == search_key:
-                        rids.append(rid)
+        """Helper: locate RIDs by index, falling back to full table scan if the column has no index."""
+        if self.table.index.has_index(search_key_index):
+            return self.table.index.locate(search_key_index, search_key)
+        # FIX: full table scan fallback for non-indexed columns
+        rids = []
+        for rid, location in self.table.page_directory.items():
+            if location[0] == 'base':
+                val = self.table.get_column_value(rid, search_key_index)
+                if val == search_key:
+                    rids.append(rid)
         return rids
 
     """
@@ -93,6 +143,9 @@ class Query:
     """
     def select(self, search_key, search_key_index, projected_columns_index, transaction = None):
         try:
+            snapshot = self._snapshot(transaction)
+            if snapshot is not None:
+                return self._select_snapshot(search_key, search_key_index, projected_columns_index, snapshot)
             rids = self._locate_rids(search_key, search_key_index)
             results = []
             for rid in rids:
@@ -106,6 +159,21 @@ class Query:
         except Exception:
             return False
 
+    def _select_snapshot(self, search_key, search_key_index, projected_columns_index, snapshot):
+        # The key never changes, so the key index finds every version; other columns are matched by a scan
+        if search_key_index == self.table.key and self.table.index.has_index(search_key_index):
+            rids = self.table.index.locate(search_key_index, search_key) or []
+        else:
+            rids = [rid for rid, location in self.table.page_directory.items() if location[0] == 'base']
+        wanted = {i for i in range(self.table.num_columns) if projected_columns_index[i] == 1}
+        results = []
+        for rid, data in self._snapshot_records(rids, wanted | {search_key_index, self.table.key}, snapshot):
+            if data[search_key_index] != search_key:
+                continue
+            columns = [data[i] if i in wanted else None for i in range(self.table.num_columns)]
+            results.append(Record(rid, data[self.table.key], columns))
+        return results
+
     """
     # Read matching record with specified search key
     # :param search_key: the value you want to search based on
@@ -138,7 +206,7 @@ class Query:
     """
     def update(self, primary_key, *columns, transaction = None):
         try:
-            if len(columns) != self.table.num_columns:
+            if len(columns) != self.table.num_columns or self._snapshot(transaction) is not None:
                 return False
             if columns[self.table.key] is not None:
                 return False
@@ -150,7 +218,35 @@ class Query:
             rid = rids[0]
             if not self._acquire_exclusive(transaction, rid):
                 return False
-            return self.table.update_record(rid, columns)
+            return self.table.update_record(rid, columns, transaction)
+        except Exception:
+            return False
+
+    """
+    # Update many records at once: column_values[i] are the new columns (None = unchanged) of the record with
+    # key keys[i], each key at most once
+    # Returns True if every update is succesful
+    # Returns False, updating nothing, if a key does not exist, appears twice, a value is not a 64-bit integer or a
+    # record cannot be locked
+    """
+    def update_many(self, keys, column_values, transaction = None):
+        try:
+            column_values = [list(columns) for columns in column_values]
+            if len(keys) != len(column_values) or self._snapshot(transaction) is not None:
+                return False
+            if not all(value is None or is_column_value(value) for columns in column_values for value in columns):
+                return False
+
+            rids = []
+            for key in keys:
+                located = self.table.index.locate(self.table.key, key)
+                if not located:
+                    return False
+                rids.append(located[0])
+            for rid in rids:
+                if not self._acquire_exclusive(transaction, rid):
+                    return False
+            return self.table.update_records(rids, column_values, transaction)
         except Exception:
             return False
 
@@ -163,19 +259,48 @@ class Query:
     # Returns False if no record exists in the given range
     """
     def sum(self, start_range, end_range, aggregate_column_index, transaction=None):
+        return self.aggregate(start_range, end_range, aggregate_column_index, 'sum', transaction)
+
+    """
+    :param start_range: int         # Start of the key range to aggregate
+    :param end_range: int           # End of the key range to aggregate
+    :param aggregate_columns: int  # Index of desired column to aggregate
+    :param operation: string        # One of 'sum', 'min', 'max', 'count', 'avg'
+    # Aggregates column values in bulk from the base pages, walking tail chains only for records updated since
+    # the last merge
+    # Returns the aggregate of the given range upon success
+    # Returns False if no record exists in the given range
+    """
+    def aggregate(self, start_range, end_range, aggregate_column_index, operation='sum', transaction=None):
         try:
-            total = 0
-            found = False
-            for key in range(start_range, end_range + 1):
-                rids = self.table.index.locate(self.table.key, key)
-                if rids:
-                    rid = rids[0]
+            rids = self.table.index.locate_range(start_range, end_range, self.table.key)
+            snapshot = self._snapshot(transaction)
+            if snapshot is not None:
+                values = [data[aggregate_column_index] for _, data in
+                          self._snapshot_records(rids or [], {aggregate_column_index, self.table.key}, snapshot)
+                          if start_range <= data[self.table.key] <= end_range]
+                count, total = len(values), sum(values)
+                minimum, maximum = (min(values), max(values)) if values else (None, None)
+            else:
+                if not rids:
+                    return False
+                for rid in rids:
                     if not self._acquire_shared(transaction, rid):
                         return False
-                    val = self.table.get_column_value(rid, aggregate_column_index)
-                    total += val
-                    found = True
-            return total if found else False
+                count, total, minimum, maximum = self.table.aggregate_column(rids, aggregate_column_index)
+            if count == 0:
+                return False
+            if operation == 'sum':
+                return total
+            if operation == 'min':
+                return minimum
+            if operation == 'max':
+                return maximum
+            if operation == 'count':
+                return count
+            if operation == 'avg':
+                return total / count
+            return False
         except Exception:
             return False
 
@@ -190,16 +315,11 @@ class Query:
     """
     def sum_version(self, start_range, end_range, aggregate_column_index, relative_version):
         try:
-            total = 0
-            found = False
-            for key in range(start_range, end_range + 1):
-                rids = self.table.index.locate(self.table.key, key)
-                if rids:
-                    rid = rids[0]
-                    val = self.table.get_version_column_value(rid, aggregate_column_index, relative_version)
-                    total += val
-                    found = True
-            return total if found else False
+            rids = self.table.index.locate_range(start_range, end_range, self.table.key)
+            if not rids:
+                return False
+            values = self.table.get_column_values(rids, aggregate_column_index, relative_version)
+            return sum(values) if values else False
         except Exception:
             return False
 
@@ -1,9 +1,16 @@
 from lstore.index import Index
 from lstore.page import Page
 from lstore.lock_manager import LockManager
+from lstore.page_directory import PageDirectory
+from lstore.merge import MergeScheduler
+from lstore.bufferpool import PAGE_SIZE
+from collections import defaultdict
+from bisect import bisect_left, bisect_right
 from time import time
+from array import array
+import struct
+import sys
 import threading
-import copy
 
 INDIRECTION_COLUMN = 0
 RID_COLUMN = 1
@@ -11,9 +18,17 @@ TIMESTAMP_COLUMN = 2
 SCHEMA_ENCODING_COLUMN = 3
 
 BASE_RID_COLUMN = 4
+# A base page range is queued for merge once it has this many pages worth of tail records
 MERGE_TAIL_PAGE_THRESHOLD = 10
 
 
+def is_column_value(value):
+    """
+    Whether value fits in a column slot, which holds a signed 64-bit integer
+    """
+    return isinstance(value, int) and -(1 << 63) <= value < 1 << 63
+
+
 class Record:
 
     def __init__(self, rid, key, columns):
@@ -30,51 +45,120 @@ class Record:
         return str(self.columns)
 
 
+class Snapshot:
+
+    """
+    A consistent read view of a table: everything written at a RID below horizon (tail records, inserts,
+    delete stamps) except what running transactions had written when it was taken (invisible)
+    :param anchor: int      #Lowest RID the view may still need to tell apart; merges stay below it
+    """
+    def __init__(self, horizon, invisible, anchor):
+        self.horizon = horizon
+        self.invisible = invisible
+        self.anchor = anchor
+
+    def sees(self, rid):
+        return rid < self.horizon and rid not in self.invisible
+
+
 class Table:
 
     """
     :param name: string         #Table name
     :param num_columns: int     #Number of Columns: all columns are integer
     :param key: int             #Index of table key in columns
+    :param version_retention: int   #Older versions kept per record for version queries, None keeps every version
+    :param wal: WriteAheadLog       #Log every change is recorded in, None to not log
+    :param cumulative: bool         #Tail records repeat every column (True) or hold only the updated ones, which
+                                    #makes updates cheaper and leaves readers to walk further down the chain
+    :param page_size: int           #Bytes per page, a multiple of 8; larger pages suit scan-heavy tables
+    :param max_concurrent_merges: int   #Background merges of this table allowed to run at once
+    :param merge_pages_per_second: int  #Merge I/O budget in pages per second, None for unlimited
     """
-    def __init__(self, name, num_columns, key, bufferpool=None):
+    def __init__(self, name, num_columns, key, bufferpool=None, version_retention=None, wal=None, cumulative=True,
+                 page_size=PAGE_SIZE, max_concurrent_merges=1, merge_pages_per_second=None):
         self.name = name
         self.key = key
         self.num_columns = num_columns
-        self.page_directory = {}
+        self.page_directory = PageDirectory()
         self.index = Index(self)
         self.next_rid = 1
         self.bufferpool = bufferpool
+        self.version_retention = version_retention
+        self.wal = wal
+        self.cumulative = cumulative
+        if not isinstance(page_size, int) or page_size <= 0 or page_size % 8:
+            raise ValueError(f"page_size must be a positive multiple of 8 bytes, got {page_size!r}")
+        self.page_size = page_size
+        self.records_per_page = page_size // 8
 
         total_columns = 5 + num_columns
-        self.base_pages = [[Page() for _ in range(total_columns)]]
-        self.tail_pages = [[Page() for _ in range(total_columns)]]
+        self.base_pages = [[Page(size=self.page_size) for _ in range(total_columns)]]
+        # A tail range's user column pages are only allocated once a tail record writes that column (None until then)
+        self.tail_pages = [[Page(size=self.page_size) for _ in range(5)] + [None] * num_columns]
 
         self.tps = [0]
 
-        self._merge_lock = threading.Lock()
-        self._merge_thread = None
-        self._updates_since_merge = 0
+        self.merge_scheduler = MergeScheduler(self, max_concurrent_merges, merge_pages_per_second)
+        # Tail records written against each base page range since it was last queued for merge
+        self._tail_records_since_merge = [0]
+        # Tail RIDs reserved by update_record whose record is not fully written yet, each mapped to its
+        # (base page range index, tail page range index)
+        self._unpublished_tails = {}
+        # Per base page range, the ascending tail RIDs targeting it that have not been merged yet, and per tail
+        # page range, how many of its records are still unmerged. None until built for a table loaded from disk
+        self.tail_lineage = [array('q')]
+        self._unmerged_tail_records = [0]
+        # Horizons (next_rid when they began) of active readers, e.g. running transactions
+        self._read_horizons = defaultdict(int)
+        # Anchors of open snapshots, RIDs written by each running transaction, and while snapshots are open the
+        # RID stamp of every delete (a snapshot still sees records deleted after it was taken)
+        self._snapshot_anchors = defaultdict(int)
+        self._uncommitted = defaultdict(list)
+        self._delete_stamps = {}
+        # Changes made by each running transaction, oldest first, for rolling them back in place
+        self._undo = defaultdict(list)
         self._table_lock = threading.Lock()
 
         self.lock_manager = LockManager()
 
+        if self.bufferpool:
+            self.bufferpool.register_table(name, 5 + num_columns, page_size)
         for col_idx, page in enumerate(self.base_pages[0]):
             self._register_page('base', 0, col_idx, page)
         for col_idx, page in enumerate(self.tail_pages[0]):
-            self._register_page('tail', 0, col_idx, page)
+            if page is not None:
+                self._register_page('tail', 0, col_idx, page)
 
     def _register_page(self, page_type, range_idx, col_idx, page):
         if self.bufferpool:
             self.bufferpool.register_page(self.name, page_type, range_idx, col_idx, page)
 
+    def _fetch_range(self, page_type, range_idx):
+        page_range = (self.base_pages if page_type == 'base' else self.tail_pages)[range_idx]
+        # Reclaimed tail ranges are None
+        if self.bufferpool and page_range is not None:
+            self.bufferpool.touch_range(page_range)
+        return page_range
+
+    # Both skip the unallocated column pages of a tail range
     def _pin_range(self, page_range):
         for page in page_range:
-            page.pin_count += 1
+            if page is None:
+                continue
+            if self.bufferpool:
+                self.bufferpool.pin_page(page)
+            else:
+                page.pin_count += 1
 
     def _unpin_range(self, page_range):
         for page in page_range:
-            page.pin_count = max(0, page.pin_count - 1)
+            if page is None:
+                continue
+            if self.bufferpool:
+                self.bufferpool.unpin_page(page)
+            else:
+                page.pin_count = max(0, page.pin_count - 1)
 
     def _read_int(self, page, record_index):
         offset = record_index * 8
@@ -84,87 +168,355 @@ class Table:
         offset = record_index * 8
         page.data[offset:offset + 8] = value.to_bytes(8, byteorder='little', signed=True)
 
-    def _merge(self):
-        from collections import defaultdict
-
+    def _merge(self, range_indices=None):
+        """
+        Consolidates tail records into copies of the given base page ranges (all ranges by default) and swaps
+        the copies in. Only tail records newer than a range's tps are consumed, so the cost follows what changed
+        since its last merge. Tail records at or above the merge boundary, the oldest tail RID that is reserved
+        but not yet fully written, are left for the next merge, so afterwards every tail record of a merged
+        range up to its tps is reflected in the base pages. Returns the number of base records consolidated.
+        """
+        self._ensure_lineage()
         with self._table_lock:
-            tps_snapshot = list(self.tps)
-            num_ranges = len(tps_snapshot)
-            pd_snapshot = dict(self.page_directory)
-        
-        base_snapshot = [[copy.deepcopy(p) for p in r] for r in self.base_pages]
-        tail_snapshot = [[copy.deepcopy(p) for p in r] for r in self.tail_pages]
-
-        for range_idx in range(num_ranges):
-            new_range = [copy.deepcopy(p) for p in base_snapshot[range_idx]]
-            current_tps = tps_snapshot[range_idx]
-
-            tail_records_rev = []
-            for tail_range in tail_snapshot:
-                num_recs = tail_range[RID_COLUMN].num_records
-                for rec_idx in range(num_recs - 1, -1, -1):
+            if range_indices is None:
+                range_indices = range(len(self.base_pages))
+            range_indices = [r for r in range_indices if r < len(self.base_pages)]
+            boundary = self._merge_boundary()
+            base_ranges = {r: self.base_pages[r] for r in range_indices}
+            # Tail RIDs each range has not merged yet, straight from its lineage
+            pending = {}
+            for r in range_indices:
+                lineage = self.tail_lineage[r]
+                pending[r] = lineage[bisect_right(lineage, self.tps[r]):bisect_left(lineage, boundary)]
+
+        # Only the merged ranges' base pages are copied; tail slots below the boundary are never rewritten,
+        # so tail records are read in place
+        new_ranges = {r: [p.copy() for p in base_ranges[r]] for r in range_indices}
+        self.merge_scheduler.throttle(sum(len(r) for r in new_ranges.values()))
+
+        tails_by_base = defaultdict(list)
+        consumed = {r: [] for r in range_indices}
+        for range_idx in range_indices:
+            # Newest first, so the first value found for a column is its latest
+            for tail_rid in reversed(pending[range_idx]):
+                tail_loc = self.page_directory.get(tail_rid)
+                if tail_loc is None:
+                    continue
+                consumed[range_idx].append(tail_loc[1])
+                tail_range = self._fetch_range('tail', tail_loc[1])
+                base_rid = self._read_int(tail_range[BASE_RID_COLUMN], tail_loc[2])
+                base_loc = self.page_directory.get(base_rid)
+                if base_loc is None or base_loc[0] != 'base':
+                    continue
+                tails_by_base[base_rid].append((tail_range, tail_loc[2], base_loc))
+
+        consolidated = 0
+        for base_rid, entries in tails_by_base.items():
+            _, range_idx, base_rec_idx = entries[0][2]
+            new_range = new_ranges[range_idx]
+            resolved_cols = set()
+
+            for tail_range, rec_idx, _ in entries:
+                schema_encoding = self._read_int(tail_range[SCHEMA_ENCODING_COLUMN], rec_idx)
+                for col_idx in range(self.num_columns):
+                    if (schema_encoding >> col_idx) & 1 and col_idx not in resolved_cols:
+                        value = self._read_int(tail_range[5 + col_idx], rec_idx)
+                        self._write_int(new_range[5 + col_idx], base_rec_idx, value)
+                        resolved_cols.add(col_idx)
+
+                if len(resolved_cols) == self.num_columns:
+                    break
+            consolidated += 1
+
+        for range_idx, new_range in new_ranges.items():
+            with self._table_lock:
+                if boundary - 1 < self.tps[range_idx]:
+                    # A concurrent merge of this range already installed a newer result
+                    continue
+                live_range = self.base_pages[range_idx]
+                merged_records = new_range[RID_COLUMN].num_records
+                live_records = live_range[RID_COLUMN].num_records
+                # Records inserted since the snapshot, and every indirection pointer, come from the live range
+                for col_idx, page in enumerate(new_range):
+                    if col_idx == INDIRECTION_COLUMN:
+                        page.data[:live_records * 8] = live_range[col_idx].data[:live_records * 8]
+                    elif live_records > merged_records:
+                        page.data[merged_records * 8:live_records * 8] = \
+                            live_range[col_idx].data[merged_records * 8:live_records * 8]
+                    page.num_records = live_records
+                self.base_pages[range_idx] = new_range
+                self.tps[range_idx] = boundary - 1
+                for col_idx, page in enumerate(new_range):
+                    self._register_page('base', range_idx, col_idx, page)
+
+                lineage = self.tail_lineage[range_idx]
+                del lineage[:bisect_right(lineage, boundary - 1)]
+                for tail_range_index in consumed[range_idx]:
+                    self._unmerged_tail_records[tail_range_index] -= 1
+
+        return consolidated
+
+    # Called with _table_lock held
+    def _merge_boundary(self):
+        # Tail records still being written or not committed yet must not reach the base pages, nor anything an
+        # open snapshot has to see past
+        boundary = min(self._unpublished_tails, default=self.next_rid)
+        boundary = min((rids[0] for rids in self._uncommitted.values() if rids), default=boundary)
+        return min(min(self._snapshot_anchors, default=boundary), boundary)
+
+    def _ensure_lineage(self):
+        """
+        Builds the tail lineage of a table loaded from disk: for each base page range, the ascending RIDs of
+        its tail records that are not merged yet, plus the number of such records per tail page range.
+        Tail records of deleted base records count as already merged.
+        """
+        if self.tail_lineage is not None:
+            return
+        with self._table_lock:
+            if self.tail_lineage is not None:
+                return
+            tail_lineage = [array('q') for _ in self.base_pages]
+            unmerged = [0] * len(self.tail_pages)
+            for tail_range_index in range(len(self.tail_pages)):
+                tail_range = self._fetch_range('tail', tail_range_index)
+                if tail_range is None:
+                    continue
+                for rec_idx in range(tail_range[RID_COLUMN].num_records):
                     tail_rid = self._read_int(tail_range[RID_COLUMN], rec_idx)
-                    if tail_rid not in pd_snapshot:
-                        continue
-                    loc = pd_snapshot[tail_rid]
-                    if loc[0] != 'tail':
-                        continue
-                    base_rid = self._read_int(tail_range[BASE_RID_COLUMN], rec_idx)
-                    if base_rid not in pd_snapshot:
+                    if tail_rid not in self.page_directory:
                         continue
-                    base_loc = pd_snapshot[base_rid]
-                    if base_loc[0] != 'base' or base_loc[1] != range_idx:
+                    base_loc = self.page_directory.get(self._read_int(tail_range[BASE_RID_COLUMN], rec_idx))
+                    if base_loc is None or tail_rid <= self.tps[base_loc[1]]:
                         continue
-                    tail_records_rev.append((tail_rid, tail_range, rec_idx, base_rid, base_loc[2]))
-
-            tails_by_base = defaultdict(list)
-            for entry in tail_records_rev:
-                tails_by_base[entry[3]].append(entry)
-
-            latest_tps = current_tps
-
-            for base_rid, entries in tails_by_base.items():
-                base_rec_idx = entries[0][4]
-                resolved_cols = set()
-
-                for tail_rid, tail_range, rec_idx, _, _ in entries:
-                    schema_encoding = self._read_int(tail_range[SCHEMA_ENCODING_COLUMN], rec_idx)
-                    schema_bits = format(schema_encoding, f'0{self.num_columns}b')[::-1]
-
-                    for col_idx in range(self.num_columns):
-                        if schema_bits[col_idx] == '1' and col_idx not in resolved_cols:
-                            value = self._read_int(tail_range[5 + col_idx], rec_idx)
-                            self._write_int(new_range[5 + col_idx], base_rec_idx, value)
-                            resolved_cols.add(col_idx)
-
-                    if len(resolved_cols) == self.num_columns:
-                        break
-
-                most_recent_tail_rid = entries[0][0]
-                self._write_int(new_range[INDIRECTION_COLUMN], base_rec_idx, most_recent_tail_rid)
-
-                if most_recent_tail_rid > latest_tps:
-                    latest_tps = most_recent_tail_rid
+                    tail_lineage[base_loc[1]].append(tail_rid)
+                    unmerged[tail_range_index] += 1
+            # Tail records reserved but not published yet are missing from the page directory; an update in
+            # flight no longer adds them to a lineage that was not built when it reserved them
+            if self._unpublished_tails:
+                for tail_rid, (base_range_index, tail_range_index) in self._unpublished_tails.items():
+                    tail_lineage[base_range_index].append(tail_rid)
+                    unmerged[tail_range_index] += 1
+                tail_lineage = [array('q', sorted(lineage)) for lineage in tail_lineage]
+            self._unmerged_tail_records = unmerged
+            self.tail_lineage = tail_lineage
+
+    def reclaimable_tail_ranges(self):
+        """
+        Tail page ranges (other than the one being appended to) whose records have all been merged
+        """
+        self._ensure_lineage()
+        with self._table_lock:
+            last = len(self.tail_pages) - 1
+            return [i for i, count in enumerate(self._unmerged_tail_records)
+                    if count == 0 and i != last and self.tail_pages[i] is not None]
+
+    def begin_read(self):
+        """
+        Registers an active reader. Versions it could still need are kept by collect_garbage until the
+        matching end_read. Returns the reader's horizon.
+        """
+        with self._table_lock:
+            horizon = self.next_rid
+            self._read_horizons[horizon] += 1
+        return horizon
 
-            with self._merge_lock:
-                if range_idx < len(self.base_pages):
-                    live_range = self.base_pages[range_idx]
-                    num_records = live_range[RID_COLUMN].num_records
-                    for rec_idx in range(num_records):
-                        live_indir = self._read_int(live_range[INDIRECTION_COLUMN], rec_idx)
-                        self._write_int(new_range[INDIRECTION_COLUMN], rec_idx, live_indir)
-                    self.base_pages[range_idx] = new_range
-                    self.tps[range_idx] = latest_tps
+    def end_read(self, horizon):
+        with self._table_lock:
+            self._read_horizons[horizon] -= 1
+            if self._read_horizons[horizon] <= 0:
+                del self._read_horizons[horizon]
+
+    def begin_snapshot(self):
+        """
+        Opens a snapshot of the table as of now. Reads through it take no locks; end it with end_snapshot.
+        """
+        with self._table_lock:
+            invisible = set(self._unpublished_tails)
+            for rids in self._uncommitted.values():
+                invisible.update(rids)
+            horizon = self.next_rid
+            anchor = min(invisible, default=horizon)
+            self._snapshot_anchors[anchor] += 1
+            self._read_horizons[anchor] += 1
+        return Snapshot(horizon, frozenset(invisible), anchor)
+
+    def end_snapshot(self, snapshot):
+        with self._table_lock:
+            self._snapshot_anchors[snapshot.anchor] -= 1
+            if self._snapshot_anchors[snapshot.anchor] <= 0:
+                del self._snapshot_anchors[snapshot.anchor]
+            if not self._snapshot_anchors:
+                # Snapshots taken from now on come after every committed delete so far
+                self._prune_delete_stamps()
+        self.end_read(snapshot.anchor)
+
+    def finish_transaction(self, transaction):
+        """
+        Called when a transaction commits or aborts: what it wrote becomes visible to new snapshots
+        """
+        with self._table_lock:
+            self._uncommitted.pop(transaction.txn_id, None)
+            self._undo.pop(transaction.txn_id, None)
+            if not self._snapshot_anchors and self._delete_stamps:
+                self._prune_delete_stamps()
+
+    # Called with _table_lock held and no snapshot open
+    def _prune_delete_stamps(self):
+        pending = set()
+        for rids in self._uncommitted.values():
+            pending.update(rids)
+        self._delete_stamps = {rid: stamp for rid, stamp in self._delete_stamps.items() if stamp in pending}
+
+    def deleted_since(self, snapshot):
+        """
+        Records deleted after the snapshot was taken, which it still sees
+        """
+        with self._table_lock:
+            return [rid for rid, stamp in self._delete_stamps.items() if not snapshot.sees(stamp)]
+
+    def get_snapshot_data(self, rid, projected_columns_index, snapshot):
+        """
+        The record as the snapshot sees it, or None if it did not exist then. Tail records the snapshot does
+        not see are skipped; the walk stops at the range's tps, since merges never go past a snapshot's anchor
+        and the base pages therefore hold what it sees of older tail records.
+        """
+        if not snapshot.sees(rid):
+            return None
+        with self._table_lock:
+            location = self.page_directory.location(rid)
+            if location is None or location[0] != 'base':
+                return None
+            if rid not in self.page_directory and snapshot.sees(self._delete_stamps.get(rid, 0)):
+                return None
+            base_page_range = self._fetch_range('base', location[1])
+            tps = self.tps[location[1]]
+            indirection = self._read_int(base_page_range[INDIRECTION_COLUMN], location[2])
+
+        wanted = [i for i in range(self.num_columns) if projected_columns_index[i] == 1]
+        values = self._resolve_column_values(wanted, indirection, base_page_range, location[2],
+                                             snapshot=snapshot, tps=tps)
+        return [values.get(i) for i in range(self.num_columns)]
+
+    def _tail_chain(self, base_rid):
+        # Tail RIDs of a record, newest first, up to the first reclaimed one
+        chain = []
+        base_loc = self.page_directory.get(base_rid)
+        base_range = self._fetch_range('base', base_loc[1])
+        tail_rid = self._read_int(base_range[INDIRECTION_COLUMN], base_loc[2])
+        while tail_rid != 0:
+            tail_loc = self.page_directory.get(tail_rid)
+            if tail_loc is None:
+                break
+            tail_range = self._fetch_range('tail', tail_loc[1])
+            if tail_range is None:
+                break
+            chain.append(tail_rid)
+            tail_rid = self._read_int(tail_range[INDIRECTION_COLUMN], tail_loc[2])
+        return chain
+
+    def _tail_retained(self, tail_rid, base_rid, anchors, chains):
+        """
+        A tail record is retained while it is one of the newest version_retention + 1 versions of its record
+        as of now or as of any active reader's horizon. Tail records of deleted records are only retained
+        while a reader is active.
+        """
+        if base_rid not in self.page_directory:
+            return len(anchors) > 1
+        if self.version_retention is None:
+            return True
+        if base_rid not in chains:
+            chains[base_rid] = self._tail_chain(base_rid)
+        chain = chains[base_rid]
+        for anchor in anchors:
+            start = 0
+            while start < len(chain) and chain[start] >= anchor:
+                start += 1
+            if tail_rid in chain[start:start + self.version_retention + 1]:
+                return True
+        return False
+
+    def collect_garbage(self):
+        """
+        Frees tail page ranges whose records are all merged and outside every retention window: their pages
+        leave the BufferPool and their RIDs leave the page directory. The range's slot stays as a hole until
+        compact_tail_pages. Returns the number of tail page ranges reclaimed.
+        """
+        candidates = self.reclaimable_tail_ranges()
+        with self._table_lock:
+            anchors = [self.next_rid] + sorted(self._read_horizons)
+
+        reclaimed = 0
+        chains = {}
+        for tail_range_index in candidates:
+            tail_range = self._fetch_range('tail', tail_range_index)
+            num_records = tail_range[RID_COLUMN].num_records
+            tail_rids = []
+            for rec_idx in range(num_records):
+                tail_rid = self._read_int(tail_range[RID_COLUMN], rec_idx)
+                if tail_rid not in self.page_directory:
+                    continue
+                base_rid = self._read_int(tail_range[BASE_RID_COLUMN], rec_idx)
+                if self._tail_retained(tail_rid, base_rid, anchors, chains):
+                    break
+                tail_rids.append(tail_rid)
+            else:
+                with self._table_lock:
+                    if self._unmerged_tail_records[tail_range_index] != 0:
+                        continue
+                    for tail_rid in tail_rids:
+                        self.page_directory.discard(tail_rid)
+                    self.tail_pages[tail_range_index] = None
+                if self.bufferpool:
+                    for col_idx in range(len(tail_range)):
+                        self.bufferpool.unregister_page(self.name, 'tail', tail_range_index, col_idx)
+                reclaimed += 1
+        return reclaimed
+
+    def compact_tail_pages(self):
+        """
+        Closes the holes left by collect_garbage by moving later tail page ranges down, so the tail page file
+        can be truncated. Only safe while no queries run (Database.close calls it). Returns the number of
+        tail page ranges moved.
+        """
+        self._ensure_lineage()
+        moved = 0
+        with self._table_lock:
+            tail_pages = []
+            unmerged = []
+            for old_index, tail_range in enumerate(self.tail_pages):
+                if tail_range is None:
+                    continue
+                new_index = len(tail_pages)
+                if new_index != old_index:
+                    for col_idx, page in enumerate(tail_range):
+                        if page is None:
+                            continue
+                        # Read from the old slot before the page takes over its new one
+                        page.data = bytearray(page.data)
+                        if self.bufferpool:
+                            self.bufferpool.unregister_page(self.name, 'tail', old_index, col_idx)
+                        page.dirty = True
+                        self._register_page('tail', new_index, col_idx, page)
+                    for rec_idx in range(tail_range[RID_COLUMN].num_records):
+                        tail_rid = self._read_int(tail_range[RID_COLUMN], rec_idx)
+                        if self.page_directory.get(tail_rid) == ('tail', old_index, rec_idx):
+                            self.page_directory[tail_rid] = ('tail', new_index, rec_idx)
+                    moved += 1
+                tail_pages.append(tail_range)
+                unmerged.append(self._unmerged_tail_records[old_index])
+            self.tail_pages = tail_pages
+            self._unmerged_tail_records = unmerged
+        return moved
 
     def _trigger_merge(self):
-        if self._merge_thread is not None and self._merge_thread.is_alive():
-            return
-        self._merge_thread = threading.Thread(target=self._merge, daemon=True)
-        self._merge_thread.start()
+        for range_idx in range(len(self.base_pages)):
+            self.merge_scheduler.request(range_idx)
 
     def wait_for_merge(self):
-        if self._merge_thread is not None:
-            self._merge_thread.join()
+        self.merge_scheduler.wait()
+
+    def merge_stats(self):
+        return self.merge_scheduler.stats()
 
     def get_record_data(self, rid, projected_columns_index):
         if rid not in self.page_directory:
@@ -174,7 +526,7 @@ class Table:
         location = self.page_directory[rid]
         record_type, page_range_index, record_index = location
         if record_type == 'base':
-            base_page_range = self.base_pages[page_range_index]
+            base_page_range = self._fetch_range('base', page_range_index)
         else:
             return None
         offset = record_index * 8
@@ -184,12 +536,10 @@ class Table:
             signed=True
         )
 
+        wanted = [i for i in range(self.num_columns) if projected_columns_index[i] == 1]
+        values = self._resolve_column_values(wanted, indirection, base_page_range, record_index)
         for i in range(self.num_columns):
-            if projected_columns_index[i] == 1:
-                value = self._get_latest_column_value(rid, i, indirection, base_page_range, record_index)
-                result.append(value)
-            else:
-                result.append(None)
+            result.append(values.get(i))
         return result
 
     def get_column_value(self, rid, column_index):
@@ -205,7 +555,7 @@ class Table:
         record_type, page_range_index, record_index = location
 
         if record_type == 'base':
-            base_page_range = self.base_pages[page_range_index]
+            base_page_range = self._fetch_range('base', page_range_index)
         else:
             return None
 
@@ -219,40 +569,231 @@ class Table:
 
         return self._get_latest_column_value(rid, column_index, indirection, base_page_range, record_index)
 
+    def get_column_values(self, rids, column_index, relative_version=0):
+        """
+        Reads one column for many records. RIDs are grouped by base page range so each range is fetched
+        once and records are visited in page order. Records that no longer exist are skipped.
+        """
+        by_range = {}
+        for rid in rids:
+            location = self.page_directory.get(rid)
+            if location is not None and location[0] == 'base':
+                by_range.setdefault(location[1], []).append(location[2])
+
+        values = []
+        for page_range_index in sorted(by_range):
+            base_page_range = self._fetch_range('base', page_range_index)
+            indirection_page = base_page_range[INDIRECTION_COLUMN]
+            for record_index in sorted(by_range[page_range_index]):
+                indirection = self._read_int(indirection_page, record_index)
+                resolved = self._resolve_column_values([column_index], indirection, base_page_range, record_index,
+                                                       abs(relative_version))
+                values.append(resolved[column_index])
+        return values
+
+    def aggregate_column(self, rids, column_index):
+        """
+        Bulk aggregate of one column over the given base records. Per page range, the column and indirection
+        pages are read as int64 arrays; a record whose indirection is at or below the range's tps has its
+        latest value in the base page already (merged), so those values are reduced in bulk. Only records
+        updated since the last merge fall back to a tail-chain walk.
+        Returns (count, total, minimum, maximum); minimum/maximum are None when count is 0.
+        """
+        by_range = {}
+        for rid in rids:
+            location = self.page_directory.get(rid)
+            if location is not None and location[0] == 'base':
+                by_range.setdefault(location[1], []).append(location[2])
+
+        count, total, minimum, maximum = 0, 0, None, None
+        for page_range_index, positions in by_range.items():
+            with self._table_lock:
+                base_page_range = self._fetch_range('base', page_range_index)
+                tps = self.tps[page_range_index]
+            num_records = base_page_range[RID_COLUMN].num_records
+            values = self._read_column_array(base_page_range[5 + column_index], num_records)
+
+            stale = []
+            if column_index == self.key:
+                # Never updated, so the base page is always current
+                fresh = values if len(positions) == num_records else [values[i] for i in positions]
+            else:
+                indirections = self._read_column_array(base_page_range[INDIRECTION_COLUMN], num_records)
+                if len(positions) == num_records and max(indirections, default=0) <= tps:
+                    fresh = values
+                else:
+                    fresh = [values[i] for i in positions if indirections[i] <= tps]
+                    stale = [i for i in positions if indirections[i] > tps]
+
+            for record_index in stale:
+                indirection = self._read_int(base_page_range[INDIRECTION_COLUMN], record_index)
+                value = self._resolve_column_values([column_index], indirection, base_page_range,
+                                                    record_index)[column_index]
+                fresh.append(value)
+
+            if not len(fresh):
+                continue
+            count += len(fresh)
+            total += sum(fresh)
+            minimum = min(fresh) if minimum is None else min(minimum, min(fresh))
+            maximum = max(fresh) if maximum is None else max(maximum, max(fresh))
+        return count, total, minimum, maximum
+
+    def _read_column_array(self, page, num_records):
+        values = array('q')
+        values.frombytes(page.data[:num_records * 8])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
     def _get_latest_column_value(self, base_rid, column_index, indirection, base_page_range, base_record_index):
+        return self._resolve_column_values([column_index], indirection, base_page_range,
+                                           base_record_index)[column_index]
+
+    def _resolve_column_values(self, column_indices, indirection, base_page_range, base_record_index, skip=0,
+                               snapshot=None, tps=None):
+        """
+        Resolves every column in column_indices with a single walk of the tail chain, stopping as soon as
+        all of them are found. A column's value is in the newest tail record whose schema encoding has its
+        bit set (any tail record, for a cumulative table), or in the base record if no tail record updated
+        it. skip ignores that many of the newest tail records, which gives older versions (skip=0 is the
+        latest). With a snapshot, tail records it does not see are ignored and the walk ends at tps.
+        Returns {column_index: value}.
+        """
+        values = {}
+        # The key column is never updated, so it is always answered by the base record
+        pending = [i for i in column_indices if i != self.key]
+        if len(pending) != len(column_indices):
+            values[self.key] = self._read_int(base_page_range[5 + self.key], base_record_index)
         current_tail_rid = indirection
 
-        while current_tail_rid != 0:
+        while current_tail_rid != 0 and pending:
+            if snapshot is not None and current_tail_rid <= tps:
+                break
             tail_location = self.page_directory.get(current_tail_rid)
             if not tail_location:
                 break
             _, tail_page_range_index, tail_record_index = tail_location
-            tail_page_range = self.tail_pages[tail_page_range_index]
+            tail_page_range = self._fetch_range('tail', tail_page_range_index)
+            if tail_page_range is None:
+                break
             tail_offset = tail_record_index * 8
 
-            schema_encoding = int.from_bytes(
-                tail_page_range[SCHEMA_ENCODING_COLUMN].data[tail_offset:tail_offset + 8],
-                byteorder='little', signed=True
-            )
-            schema_bits = format(schema_encoding, f'0{self.num_columns}b')[::-1]
+            schema_encoding = self._read_int(tail_page_range[SCHEMA_ENCODING_COLUMN], tail_record_index)
+            # A base image (the key column's bit set) holds original values rather than a version of its own: it is
+            # never skipped, so versions older than a column's first update read it from there, not from the
+            # base pages a merge may have rewritten
+            if skip and not (schema_encoding >> self.key) & 1:
+                skip -= 1
+            elif snapshot is not None and not snapshot.sees(current_tail_rid):
+                pass
+            elif schema_encoding:
+                still_pending = []
+                for column_index in pending:
+                    # A cumulative tail record holds every column as of its version, so the walk ends here
+                    if self.cumulative or (schema_encoding >> column_index) & 1:
+                        values[column_index] = int.from_bytes(
+                            tail_page_range[5 + column_index].data[tail_offset:tail_offset + 8],
+                            byteorder='little', signed=True
+                        )
+                    else:
+                        still_pending.append(column_index)
+                pending = still_pending
 
-            if schema_bits[column_index] == '1':
-                return int.from_bytes(
-                    tail_page_range[5 + column_index].data[tail_offset:tail_offset + 8],
-                    byteorder='little', signed=True
-                )
             current_tail_rid = int.from_bytes(
                 tail_page_range[INDIRECTION_COLUMN].data[tail_offset:tail_offset + 8],
                 byteorder='little', signed=True
             )
 
-        offset = base_record_index * 8
-        return int.from_bytes(
-            base_page_range[5 + column_index].data[offset:offset + 8],
-            byteorder='little', signed=True
-        )
-
-    def add_base_record(self, columns, schema_encoding):
+        for column_index in pending:
+            values[column_index] = self._read_int(base_page_range[5 + column_index], base_record_index)
+        return values
+
+    # Both called with _table_lock held
+    def _append_base_range(self):
+        page_range = [Page(size=self.page_size) for _ in range(5 + self.num_columns)]
+        self.base_pages.append(page_range)
+        self.tps.append(0)
+        self._tail_records_since_merge.append(0)
+        if self.tail_lineage is not None:
+            self.tail_lineage.append(array('q'))
+        for col_idx, page in enumerate(page_range):
+            self._register_page('base', len(self.base_pages) - 1, col_idx, page)
+        return page_range
+
+    def _append_tail_range(self):
+        page_range = [Page(size=self.page_size) for _ in range(5)] + [None] * self.num_columns
+        self.tail_pages.append(page_range)
+        for col_idx, page in enumerate(page_range[:5]):
+            self._register_page('tail', len(self.tail_pages) - 1, col_idx, page)
+        return page_range
+
+    def _ensure_tail_columns(self, tail_range_index, column_indices):
+        """
+        Allocates and registers the missing user column pages of a tail range that is about to hold a record
+        writing column_indices. Called with _table_lock held, before the record's slot is counted.
+        """
+        tail_range = self.tail_pages[tail_range_index]
+        for column_index in column_indices:
+            if tail_range[5 + column_index] is None:
+                page = Page(size=self.page_size)
+                # Keeps the page's record count in step with the rest of the range
+                page.num_records = tail_range[RID_COLUMN].num_records
+                tail_range[5 + column_index] = page
+                self._register_page('tail', tail_range_index, 5 + column_index, page)
+
+    def _base_image_columns(self, columns, indirection):
+        """
+        The user columns whose original values an update must save in a base image before its own tail record:
+        those it changes that no tail record in the chain from indirection has changed yet (every column, on a
+        cumulative table's first update). A base image, marked by the key column's schema bit, keeps them
+        reachable for version reads once a merge rewrites the base pages.
+        """
+        if self.cumulative:
+            return list(range(self.num_columns)) if indirection == 0 else []
+        pending = [i for i, value in enumerate(columns) if value is not None]
+        while indirection != 0 and pending:
+            tail_location = self.page_directory.get(indirection)
+            tail_page_range = self._fetch_range('tail', tail_location[1]) if tail_location else None
+            if tail_page_range is None:
+                # The older versions were reclaimed, and the original values with them
+                return []
+            schema_encoding = self._read_int(tail_page_range[SCHEMA_ENCODING_COLUMN], tail_location[2])
+            pending = [i for i in pending if not (schema_encoding >> i) & 1]
+            indirection = self._read_int(tail_page_range[INDIRECTION_COLUMN], tail_location[2])
+        return pending
+
+    def _base_image(self, image_columns, indirection, tail_rid, timestamp, base_rid, base_page_range,
+                    base_record_index):
+        # The base image tail record; the key column's value is stored too, since merges apply its schema bit
+        schema_encoding = 0
+        values = [0] * self.num_columns
+        for i in set(image_columns) | {self.key}:
+            schema_encoding |= 1 << i
+            values[i] = self._read_int(base_page_range[5 + i], base_record_index)
+        return [indirection, tail_rid, timestamp, schema_encoding, base_rid] + values
+
+    def _written_columns(self, columns):
+        # User columns a tail record for this update stores a value in
+        if self.cumulative:
+            return range(self.num_columns)
+        return [i for i, value in enumerate(columns) if value is not None]
+
+    def tail_column_masks(self):
+        """
+        Per tail range, a bitmask of the user columns whose tail page has been allocated (saved in the catalog)
+        """
+        with self._table_lock:
+            masks = []
+            for tail_range in self.tail_pages:
+                mask = 0
+                for column_index, page in enumerate(tail_range[5:] if tail_range is not None else ()):
+                    if page is not None:
+                        mask |= 1 << column_index
+                masks.append(mask)
+            return masks
+
+    def add_base_record(self, columns, schema_encoding, transaction=None):
         with self._table_lock:
             rid = self.next_rid
             self.next_rid += 1
@@ -260,111 +801,253 @@ class Table:
             # CHANGE: capacity check and record_index capture inside the lock
             current_page_range = self.base_pages[-1]
             if not current_page_range[0].has_capacity():
-                total_columns = 5 + self.num_columns
-                self.base_pages.append([Page() for _ in range(total_columns)])
-                self.tps.append(0)
-                current_page_range = self.base_pages[-1]
-                new_range_idx = len(self.base_pages) - 1
-                for col_idx, page in enumerate(current_page_range):
-                    self._register_page('base', new_range_idx, col_idx, page)
+                current_page_range = self._append_base_range()
 
             record_index = current_page_range[0].num_records
             page_range_index = len(self.base_pages) - 1
-
-            current_page_range[INDIRECTION_COLUMN].write(0)
-            current_page_range[RID_COLUMN].write(rid)
-            current_page_range[TIMESTAMP_COLUMN].write(int(time()))
-            current_page_range[SCHEMA_ENCODING_COLUMN].write(int(schema_encoding, 2))
-            current_page_range[BASE_RID_COLUMN].write(rid)
-
-            for i, value in enumerate(columns):
-                current_page_range[5 + i].write(value)
+            if transaction is not None:
+                self._uncommitted[transaction.txn_id].append(rid)
+                self._undo[transaction.txn_id].append(('insert', rid))
+
+            self._pin_range(current_page_range)
+            try:
+                record = [0, rid, int(time()), int(schema_encoding, 2), rid] + list(columns)
+                for page, value in zip(current_page_range, record):
+                    page.write(value)
+                # Logged while the pages are still pinned (no eviction) and the table lock is held (no checkpoint),
+                # so they cannot reach disk before their log record
+                if self.wal:
+                    self.wal.log_insert(self._txn_id(transaction), self.name, rid, page_range_index,
+                                        record_index, record)
+            finally:
+                self._unpin_range(current_page_range)
 
             self.page_directory[rid] = ('base', page_range_index, record_index)
 
         return rid
 
+    def add_base_records(self, rows, transaction=None):
+        """
+        Bulk add_base_record for new records (all-zero schema encoding): reserves one block of RIDs and fills
+        base pages column by column, each run of slots with a single packed write. Returns the RIDs in order.
+        """
+        rows = [list(row) for row in rows]
+        if not rows:
+            return []
+        records_per_page = self.records_per_page
+        with self._table_lock:
+            first_rid = self.next_rid
+            self.next_rid += len(rows)
+            rids = range(first_rid, first_rid + len(rows))
+            if transaction is not None:
+                self._uncommitted[transaction.txn_id].extend(rids)
+                self._undo[transaction.txn_id].extend(('insert', rid) for rid in rids)
+
+            now = int(time())
+            start = 0
+            while start < len(rows):
+                current_page_range = self.base_pages[-1]
+                if not current_page_range[0].has_capacity():
+                    current_page_range = self._append_base_range()
+                page_range_index = len(self.base_pages) - 1
+                record_index = current_page_range[0].num_records
+                count = min(len(rows) - start, records_per_page - record_index)
+                chunk = rows[start:start + count]
+                chunk_rids = rids[start:start + count]
+
+                columns = [[0] * count, chunk_rids, [now] * count, [0] * count, chunk_rids]
+                columns += [[row[i] for row in chunk] for i in range(self.num_columns)]
+                packer = struct.Struct(f'<{count}q')
+                self._pin_range(current_page_range)
+                try:
+                    for page, values in zip(current_page_range, columns):
+                        packer.pack_into(page.data, record_index * 8, *values)
+                        page.dirty = True
+                    # Counted once every column is written, so a failed write cannot leave the range's pages
+                    # holding different numbers of records
+                    for page in current_page_range:
+                        page.num_records = record_index + count
+                    if self.wal:
+                        txn_id = self._txn_id(transaction)
+                        for offset, (rid, row) in enumerate(zip(chunk_rids, chunk)):
+                            self.wal.log_insert(txn_id, self.name, rid, page_range_index, record_index + offset,
+                                                [0, rid, now, 0, rid] + row)
+                finally:
+                    self._unpin_range(current_page_range)
+
+                self.page_directory.set_block(chunk_rids[0], ('base', page_range_index, record_index), count)
+                start += count
+
+        return list(rids)
+
     def get_version_data(self, rid, projected_columns_index, relative_version):
         if rid not in self.page_directory:
             return None
 
-        result = []
-
-        for i in range(self.num_columns):
-            if projected_columns_index[i] == 1:
-                value = self.get_version_column_value(rid, i, relative_version)
-                result.append(value)
-            else:
-                result.append(None)
+        location = self.page_directory[rid]
+        base_page_range = self._fetch_range('base', location[1])
+        indirection = self._read_int(base_page_range[INDIRECTION_COLUMN], location[2])
 
-        return result
+        wanted = [i for i in range(self.num_columns) if projected_columns_index[i] == 1]
+        values = self._resolve_column_values(wanted, indirection, base_page_range, location[2], abs(relative_version))
+        return [values.get(i) for i in range(self.num_columns)]
 
     def get_version_column_value(self, rid, column_index, relative_version):
         if rid not in self.page_directory:
             return None
 
-        location = self.page_directory[rid]
-        base_page_range = self.base_pages[location[1]]
-        base_offset = location[2] * 8
-
-        tail_chain = []
-        current_tail_rid = int.from_bytes(
-            base_page_range[INDIRECTION_COLUMN].data[base_offset:base_offset + 8],
-            byteorder='little', signed=True
-        )
-
-        while current_tail_rid != 0:
-            if current_tail_rid not in self.page_directory:
-                break
-            tail_chain.append(current_tail_rid)
-            tail_loc = self.page_directory[current_tail_rid]
-            tail_page_range = self.tail_pages[tail_loc[1]]
-            tail_offset = tail_loc[2] * 8
-            current_tail_rid = int.from_bytes(
-                tail_page_range[INDIRECTION_COLUMN].data[tail_offset:tail_offset + 8],
-                byteorder='little', signed=True
-            )
-
-        skip = abs(relative_version)
-        search_chain = tail_chain[skip:]
-
-        for tail_rid in search_chain:
-            tail_loc = self.page_directory[tail_rid]
-            t_page_range = self.tail_pages[tail_loc[1]]
-            t_offset = tail_loc[2] * 8
+        projected_columns_index = [0] * self.num_columns
+        projected_columns_index[column_index] = 1
+        return self.get_version_data(rid, projected_columns_index, relative_version)[column_index]
 
-            schema_encoding = int.from_bytes(
-                t_page_range[SCHEMA_ENCODING_COLUMN].data[t_offset:t_offset + 8],
-                byteorder='little', signed=True
-            )
-
-            schema_bits = format(schema_encoding, f'0{self.num_columns}b')[::-1]
-
-            if schema_bits[column_index] == '1':
-                return int.from_bytes(
-                    t_page_range[5 + column_index].data[t_offset:t_offset + 8],
-                    byteorder='little', signed=True
-                )
+    def _redo_record(self, page_type, range_idx, offset, record):
+        """
+        Recovery: writes a logged record image back to its slot, allocating page ranges as needed
+        """
+        with self._table_lock:
+            page_ranges = self.base_pages if page_type == 'base' else self.tail_pages
+            while len(page_ranges) <= range_idx:
+                self._append_base_range() if page_type == 'base' else self._append_tail_range()
+            if page_type == 'tail':
+                schema_encoding = record[SCHEMA_ENCODING_COLUMN]
+                written = [i for i in range(self.num_columns)
+                           if self.cumulative or (schema_encoding >> i) & 1 or record[5 + i]]
+                self._ensure_tail_columns(range_idx, written)
+            for page, value in zip(page_ranges[range_idx], record):
+                if page is None:
+                    continue
+                self._write_int(page, offset, value)
+                page.num_records = max(page.num_records, offset + 1)
+                page.dirty = True
+            self.next_rid = max(self.next_rid, record[RID_COLUMN] + 1)
+            self.page_directory[record[RID_COLUMN]] = (page_type, range_idx, offset)
+            if page_type == 'tail':
+                # Redone tail records are missing from the lineage; it is rebuilt from the pages when needed
+                self.tail_lineage = None
+
+    def _redo_indirection(self, range_idx, offset, indirection):
+        with self._table_lock:
+            page = self.base_pages[range_idx][INDIRECTION_COLUMN]
+            # Pinned so the frame cannot be evicted between faulting it in and marking it dirty
+            self._pin_range([page])
+            self._write_int(page, offset, indirection)
+            page.dirty = True
+            self._unpin_range([page])
 
-        return int.from_bytes(
-            base_page_range[5 + column_index].data[base_offset:base_offset + 8],
-            byteorder='little', signed=True
-        )
+    def _undo_insert(self, rid):
+        with self._table_lock:
+            self.page_directory.discard(rid)
 
-    def update_record(self, rid, columns):
+    def _undo_update(self, tail_rid, base_range, base_offset, prev_indirection):
+        """
+        Unlinks a tail record from its base record's version chain and forgets it. Idempotent, so recovery can
+        repeat it.
+        """
+        with self._table_lock:
+            page = self.base_pages[base_range][INDIRECTION_COLUMN]
+            self._pin_range([page])
+            self._write_int(page, base_offset, prev_indirection)
+            page.dirty = True
+            self._unpin_range([page])
+            tail_loc = self.page_directory.get(tail_rid)
+            self.page_directory.discard(tail_rid)
+            if tail_loc is not None:
+                self._forget_lineage(tail_rid, base_range, tail_loc[1])
+
+    def _forget_lineage(self, tail_rid, base_range, tail_range_index):
+        # The merge never has to consume the record, so it must not hold up reclaiming its tail range
+        if self.tail_lineage is None:
+            return
+        lineage = self.tail_lineage[base_range]
+        idx = bisect_left(lineage, tail_rid)
+        if idx < len(lineage) and lineage[idx] == tail_rid:
+            del lineage[idx]
+            self._unmerged_tail_records[tail_range_index] -= 1
+
+    def _abandon_tails(self, tail_rids, base_ranges, runs, published=0):
+        """
+        Gives up the tail records an update reserved but failed to publish (all but the first `published`):
+        their RIDs no longer hold back the merge and their tail ranges are unpinned. The slots stay dead;
+        nothing points at them. runs holds (tail page range index, tail page range, first slot, first update,
+        count) for each run of consecutive slots, in update order.
+        """
+        with self._table_lock:
+            for tail_rid in tail_rids:
+                self._unpublished_tails.pop(tail_rid, None)
+            for tail_page_range_index, tail_range, _, start, count in runs:
+                if start + count <= published:
+                    continue
+                for k in range(max(start, published), start + count):
+                    self._forget_lineage(tail_rids[k], base_ranges[k], tail_page_range_index)
+                self._unpin_range(tail_range)
+
+    def _undo_delete(self, rid):
+        with self._table_lock:
+            self.page_directory.restore(rid)
+            self._delete_stamps.pop(rid, None)
+
+    def rollback(self, transaction):
+        """
+        Undoes the transaction's changes to this table in place, newest first: updates are unlinked from their
+        version chains, deleted records come back under their own RIDs and inserted ones are forgotten. Nothing
+        new is written to the pages. The transaction must still hold its locks.
+        """
+        with self._table_lock:
+            undo = self._undo.pop(transaction.txn_id, [])
+        indexed = [i for i in range(self.num_columns) if self.index.indices[i] is not None]
+        everything = [1] * self.num_columns
+
+        for entry in reversed(undo):
+            kind, rid = entry[0], entry[1]
+            if kind == 'insert':
+                values = self.get_record_data(rid, everything)
+                if values is not None:
+                    for i in indexed:
+                        self.index.remove_key(i, values[i], rid)
+                self._undo_insert(rid)
+                if self.wal:
+                    self.wal.log_undo_insert(transaction.txn_id, self.name, rid)
+            elif kind == 'update':
+                tail_rid, base_range, base_offset, prev_indirection = entry[2:]
+                before = self.get_record_data(rid, everything)
+                self._undo_update(tail_rid, base_range, base_offset, prev_indirection)
+                if self.wal:
+                    self.wal.log_undo_update(transaction.txn_id, self.name, tail_rid, base_range, base_offset,
+                                             prev_indirection)
+                after = self.get_record_data(rid, everything)
+                if before is not None and after is not None:
+                    for i in indexed:
+                        if before[i] != after[i]:
+                            self.index.update_key(i, before[i], after[i], rid)
+            elif kind == 'delete':
+                self._undo_delete(rid)
+                if self.wal:
+                    self.wal.log_undo_delete(transaction.txn_id, self.name, rid)
+                values = self.get_record_data(rid, everything)
+                if values is not None:
+                    for i in indexed:
+                        self.index.add_to_index(i, values[i], rid)
+
+    @staticmethod
+    def _txn_id(transaction):
+        return transaction.txn_id if transaction is not None else 0
+
+    def update_record(self, rid, columns, transaction=None):
         if rid not in self.page_directory:
             return False
         if len(columns) != self.num_columns:
             return False
         if columns[self.key] is not None:
             return False
+        if not all(value is None or is_column_value(value) for value in columns):
+            return False
 
         base_location = self.page_directory[rid]
         record_type, base_page_range_index, base_record_index = base_location
         if record_type != 'base':
             return False
 
-        base_page_range = self.base_pages[base_page_range_index]
+        base_page_range = self._fetch_range('base', base_page_range_index)
         base_offset = base_record_index * 8
 
         current_indirection = int.from_bytes(
@@ -379,52 +1062,306 @@ class Table:
             if val is not None:
                 schema_bits[i] = '1'
         schema_encoding_val = int(''.join(schema_bits[::-1]), 2)
+        image_columns = self._base_image_columns(columns, current_indirection)
+        new_records = 2 if image_columns else 1
 
+        merge_range = None
         with self._table_lock:
-            tail_rid = self.next_rid
-            self.next_rid += 1
+            tail_rids = range(self.next_rid, self.next_rid + new_records)
+            tail_rid = tail_rids[-1]
+            self.next_rid += new_records
+            if transaction is not None:
+                self._uncommitted[transaction.txn_id].extend(tail_rids)
 
-            if not self.tail_pages[-1][0].has_capacity():
-                self.tail_pages.append([Page() for _ in range(5 + self.num_columns)])
-                new_range_idx = len(self.tail_pages) - 1
-                for col_idx, page in enumerate(self.tail_pages[new_range_idx]):
-                    self._register_page('tail', new_range_idx, col_idx, page)
+            self._tail_records_since_merge[base_page_range_index] += new_records
+            merge_threshold = MERGE_TAIL_PAGE_THRESHOLD * self.records_per_page
+            if self._tail_records_since_merge[base_page_range_index] >= merge_threshold:
+                self._tail_records_since_merge[base_page_range_index] = 0
+                merge_range = base_page_range_index
+
+            if self.records_per_page - self.tail_pages[-1][0].num_records < new_records:
+                self._append_tail_range()
 
             current_tail_range = self.tail_pages[-1]
             tail_page_range_index = len(self.tail_pages) - 1
-            tail_record_index = current_tail_range[0].num_records
-
+            first_record_index = current_tail_range[0].num_records
+            tail_record_index = first_record_index + new_records - 1
+            for new_rid in tail_rids:
+                self._unpublished_tails[new_rid] = (base_page_range_index, tail_page_range_index)
+            if self.tail_lineage is not None:
+                self.tail_lineage[base_page_range_index].extend(tail_rids)
+                if tail_page_range_index == len(self._unmerged_tail_records):
+                    self._unmerged_tail_records.append(0)
+                self._unmerged_tail_records[tail_page_range_index] += new_records
+
+            written = set(self._written_columns(columns))
+            if image_columns:
+                written.update(image_columns + [self.key])
+            self._ensure_tail_columns(tail_page_range_index, sorted(written))
             for page in current_tail_range:
-                page.num_records += 1 
+                if page is not None:
+                    page.num_records += new_records
+            self._pin_range(current_tail_range)
 
         def write_slot(page, idx, value):
             offset = idx * 8
             page.data[offset:offset + 8] = value.to_bytes(8, byteorder='little', signed=True)
             page.dirty = True
 
-        write_slot(current_tail_range[INDIRECTION_COLUMN], tail_record_index, current_indirection)
-        write_slot(current_tail_range[RID_COLUMN], tail_record_index, tail_rid)
-        write_slot(current_tail_range[TIMESTAMP_COLUMN], tail_record_index, int(time()))
-        write_slot(current_tail_range[SCHEMA_ENCODING_COLUMN], tail_record_index, schema_encoding_val)
-        write_slot(current_tail_range[BASE_RID_COLUMN], tail_record_index, rid)
-        
-        for i in range(self.num_columns):
-            if columns[i] is not None:
-                value = columns[i]
-            else:
-                value = self._get_latest_column_value(rid, i, current_indirection, base_page_range, base_record_index)
-            write_slot(current_tail_range[5 + i], tail_record_index, value)
+        published = False
+        try:
+            # Previous values of updated indexed columns are needed to move their index entries
+            reindexed = [i for i in range(self.num_columns)
+                         if columns[i] is not None and self.index.indices[i] is not None]
+            # Cumulative tail records repeat the latest value of every column left unchanged; otherwise those
+            # slots hold 0 and the schema encoding tells readers to look further down the chain
+            unchanged = [i for i in range(self.num_columns) if columns[i] is None] if self.cumulative else []
+            latest = self._resolve_column_values(unchanged + reindexed, current_indirection, base_page_range,
+                                                 base_record_index)
+            now = int(time())
+            records = []
+            if image_columns:
+                records.append(self._base_image(image_columns, current_indirection, tail_rids[0], now, rid,
+                                                base_page_range, base_record_index))
+            record = [tail_rids[0] if image_columns else current_indirection, tail_rid, now, schema_encoding_val,
+                      rid]
+            record += [columns[i] if columns[i] is not None else latest.get(i, 0) for i in range(self.num_columns)]
+            records.append(record)
+            for k, new_record in enumerate(records):
+                for page, value in zip(current_tail_range, new_record):
+                    if page is not None:
+                        write_slot(page, first_record_index + k, value)
+
+            with self._table_lock:
+                current_base_page_range = self.base_pages[base_page_range_index]
+                indirection_page = current_base_page_range[INDIRECTION_COLUMN]
+                self._pin_range([indirection_page])
+                try:
+                    prev_indirection = self._read_int(indirection_page, base_record_index)
+                    # Logged before the indirection changes, so a failed log write leaves the record as it was.
+                    # The tail range stays pinned, and the table lock held, until the indirection is written so
+                    # that neither page can reach disk (by eviction or checkpoint) before the log record
+                    # A base image is logged as an update of its own, which the actual update then follows
+                    prev_indirections = [prev_indirection] + list(tail_rids[:-1])
+                    if self.wal:
+                        for k, new_record in enumerate(records):
+                            self.wal.log_update(self._txn_id(transaction), self.name, tail_rids[k],
+                                                tail_page_range_index, first_record_index + k,
+                                                base_page_range_index, base_record_index, prev_indirections[k],
+                                                new_record)
+                    self._write_int(indirection_page, base_record_index, tail_rid)
+                    indirection_page.dirty = True
+                finally:
+                    self._unpin_range([indirection_page])
+                for k, new_rid in enumerate(tail_rids):
+                    self.page_directory[new_rid] = ('tail', tail_page_range_index, first_record_index + k)
+                    del self._unpublished_tails[new_rid]
+                published = True
+                self._unpin_range(current_tail_range)
+                if transaction is not None:
+                    for new_rid, prev in zip(tail_rids, prev_indirections):
+                        self._undo[transaction.txn_id].append(
+                            ('update', rid, new_rid, base_page_range_index, base_record_index, prev))
+        finally:
+            if not published:
+                self._abandon_tails(tail_rids, [base_page_range_index] * new_records,
+                                    [(tail_page_range_index, current_tail_range, first_record_index, 0,
+                                      new_records)])
+
+        if merge_range is not None:
+            self.merge_scheduler.request(merge_range)
+
+        for i in reindexed:
+            if latest[i] != columns[i]:
+                self.index.update_key(i, latest[i], columns[i], rid)
+        return True
 
+    def update_records(self, rids, columns_list, transaction=None):
+        """
+        Bulk update_record: columns_list[i] holds the new columns (None = unchanged) of base record rids[i];
+        each record may appear once. Tail slots and RIDs for the whole batch are reserved in one critical
+        section, every record's current values come from a single walk of its version chain, tail pages are
+        filled column by column with packed writes, and all indirection pointers are published in a second
+        critical section. Returns False, changing nothing, if any update is invalid.
+        """
+        columns_list = [list(columns) for columns in columns_list]
+        if len(rids) != len(columns_list) or len(set(rids)) != len(rids):
+            return False
+        base_locations = []
+        for rid, columns in zip(rids, columns_list):
+            location = self.page_directory.get(rid)
+            if location is None or location[0] != 'base':
+                return False
+            if len(columns) != self.num_columns or columns[self.key] is not None:
+                return False
+            if not all(value is None or is_column_value(value) for value in columns):
+                return False
+            base_locations.append(location)
+        if not rids:
+            return True
+
+        # As in update_record, an update may need a base image first. owners[j] is the update tail record j
+        # belongs to and images[j] the columns it saves if it is a base image (None otherwise)
+        base_ranges = {}
+        indirections = []
+        owners = []
+        images = []
+        for k, (_, base_page_range_index, base_record_index) in enumerate(base_locations):
+            if base_page_range_index not in base_ranges:
+                base_ranges[base_page_range_index] = self._fetch_range('base', base_page_range_index)
+            indirection = self._read_int(base_ranges[base_page_range_index][INDIRECTION_COLUMN], base_record_index)
+            indirections.append(indirection)
+            image_columns = self._base_image_columns(columns_list[k], indirection)
+            if image_columns:
+                owners.append(k)
+                images.append(image_columns)
+            owners.append(k)
+            images.append(None)
+
+        records_per_page = self.records_per_page
+        merge_ranges = set()
+        # Runs of consecutive tail slots: (tail page range index, tail page range, first slot, first tail record,
+        # count)
+        runs = []
         with self._table_lock:
-            current_base_page_range = self.base_pages[base_page_range_index]
-            current_base_page_range[INDIRECTION_COLUMN].data[base_offset:base_offset + 8] = \
-            tail_rid.to_bytes(8, byteorder='little', signed=True)
-            current_base_page_range[INDIRECTION_COLUMN].dirty = True
-            self.page_directory[tail_rid] = ('tail', tail_page_range_index, tail_record_index)
-
+            first_tail_rid = self.next_rid
+            self.next_rid += len(owners)
+            tail_rids = range(first_tail_rid, first_tail_rid + len(owners))
+            if transaction is not None:
+                self._uncommitted[transaction.txn_id].extend(tail_rids)
+
+            for k, tail_rid in zip(owners, tail_rids):
+                base_page_range_index = base_locations[k][1]
+                self._tail_records_since_merge[base_page_range_index] += 1
+                merge_threshold = MERGE_TAIL_PAGE_THRESHOLD * records_per_page
+                if self._tail_records_since_merge[base_page_range_index] >= merge_threshold:
+                    self._tail_records_since_merge[base_page_range_index] = 0
+                    merge_ranges.add(base_page_range_index)
+                if self.tail_lineage is not None:
+                    self.tail_lineage[base_page_range_index].append(tail_rid)
+
+            start = 0
+            while start < len(owners):
+                if not self.tail_pages[-1][0].has_capacity():
+                    self._append_tail_range()
+                current_tail_range = self.tail_pages[-1]
+                tail_page_range_index = len(self.tail_pages) - 1
+                tail_record_index = current_tail_range[0].num_records
+                count = min(len(owners) - start, records_per_page - tail_record_index)
+                if self.tail_lineage is not None:
+                    if tail_page_range_index == len(self._unmerged_tail_records):
+                        self._unmerged_tail_records.append(0)
+                    self._unmerged_tail_records[tail_page_range_index] += count
+                written = set()
+                for j in range(start, start + count):
+                    self._unpublished_tails[tail_rids[j]] = (base_locations[owners[j]][1], tail_page_range_index)
+                    if images[j] is not None:
+                        written.update(images[j] + [self.key])
+                    else:
+                        written.update(self._written_columns(columns_list[owners[j]]))
+                self._ensure_tail_columns(tail_page_range_index, sorted(written))
+                for page in current_tail_range:
+                    if page is None:
+                        continue
+                    page.num_records += count
+                self._pin_range(current_tail_range)
+                runs.append((tail_page_range_index, current_tail_range, tail_record_index, start, count))
+                start += count
+
+        # Number of tail records, in order, that have been published
+        published = 0
+        try:
+            now = int(time())
+            reindexed_by_update = []
+            tail_records = []
+            for k, (columns, (_, base_page_range_index, base_record_index)) in enumerate(
+                    zip(columns_list, base_locations)):
+                base_page_range = base_ranges[base_page_range_index]
+                current_indirection = previous = indirections[k]
+                image_columns = images[len(tail_records)]
+                if image_columns is not None:
+                    previous = tail_rids[len(tail_records)]
+                    tail_records.append(self._base_image(image_columns, current_indirection, previous, now, rids[k],
+                                                         base_page_range, base_record_index))
+                schema_encoding = 0
+                for i, value in enumerate(columns):
+                    if value is not None:
+                        schema_encoding |= 1 << i
+                reindexed = [i for i in range(self.num_columns)
+                             if columns[i] is not None and self.index.indices[i] is not None]
+                unchanged = [i for i in range(self.num_columns) if columns[i] is None] if self.cumulative else []
+                latest = self._resolve_column_values(unchanged + reindexed, current_indirection, base_page_range,
+                                                     base_record_index)
+                reindexed_by_update.append((reindexed, latest))
+                tail_records.append([previous, tail_rids[len(tail_records)], now, schema_encoding, rids[k]] +
+                                    [columns[i] if columns[i] is not None else latest.get(i, 0)
+                                     for i in range(self.num_columns)])
+
+            for _, tail_range, tail_record_index, start, count in runs:
+                packer = struct.Struct(f'<{count}q')
+                chunk = tail_records[start:start + count]
+                for col_idx, page in enumerate(tail_range):
+                    if page is None:
+                        continue
+                    packer.pack_into(page.data, tail_record_index * 8, *[record[col_idx] for record in chunk])
+                    page.dirty = True
+
+            with self._table_lock:
+                indirection_pages = {}
+                for _, base_page_range_index, _ in base_locations:
+                    if base_page_range_index not in indirection_pages:
+                        indirection_pages[base_page_range_index] = \
+                            self.base_pages[base_page_range_index][INDIRECTION_COLUMN]
+                self._pin_range(indirection_pages.values())
+                try:
+                    undo = self._undo[transaction.txn_id] if transaction is not None else None
+                    for tail_page_range_index, tail_range, tail_record_index, start, count in runs:
+                        try:
+                            # A base image is published as an update of its own, which the actual update
+                            # then follows
+                            for j in range(start, start + count):
+                                _, base_page_range_index, base_record_index = base_locations[owners[j]]
+                                indirection_page = indirection_pages[base_page_range_index]
+                                prev_indirection = self._read_int(indirection_page, base_record_index)
+                                if self.wal:
+                                    self.wal.log_update(self._txn_id(transaction), self.name, tail_rids[j],
+                                                        tail_page_range_index, tail_record_index + j - start,
+                                                        base_page_range_index, base_record_index,
+                                                        prev_indirection, tail_records[j])
+                                self._write_int(indirection_page, base_record_index, tail_rids[j])
+                                indirection_page.dirty = True
+                                if undo is not None:
+                                    undo.append(('update', rids[owners[j]], tail_rids[j], base_page_range_index,
+                                                 base_record_index, prev_indirection))
+                                published = j + 1
+                        finally:
+                            # Even a run cut short publishes the records whose indirection already points at them
+                            if published > start:
+                                self.page_directory.set_block(tail_rids[start],
+                                                              ('tail', tail_page_range_index, tail_record_index),
+                                                              published - start)
+                        self._unpin_range(tail_range)
+                finally:
+                    self._unpin_range(indirection_pages.values())
+                for tail_rid in tail_rids:
+                    del self._unpublished_tails[tail_rid]
+        finally:
+            if published < len(owners):
+                self._abandon_tails(tail_rids, [base_locations[k][1] for k in owners], runs, published)
+
+        for merge_range in merge_ranges:
+            self.merge_scheduler.request(merge_range)
+
+        index_changes = defaultdict(list)
+        for rid, columns, (reindexed, latest) in zip(rids, columns_list, reindexed_by_update):
+            for i in reindexed:
+                if latest[i] != columns[i]:
+                    index_changes[i].append((latest[i], columns[i], rid))
+        for i, changes in index_changes.items():
+            self.index.update_keys(i, changes)
         return True
 
-    def delete_record(self, rid):
+    def delete_record(self, rid, transaction=None):
         if rid not in self.page_directory:
             return False
 
@@ -436,4 +1373,14 @@ class Table:
         
         with self._table_lock:
             del self.page_directory[rid]
+            if self._snapshot_anchors or transaction is not None:
+                # Deletes take a RID as their stamp so snapshots can order them against other writes
+                stamp = self.next_rid
+                self.next_rid += 1
+                self._delete_stamps[rid] = stamp
+                if transaction is not None:
+                    self._uncommitted[transaction.txn_id].append(stamp)
+                    self._undo[transaction.txn_id].append(('delete', rid))
+            if self.wal:
+                self.wal.log_delete(self._txn_id(transaction), self.name, rid)
         return True
\ No newline at end of file
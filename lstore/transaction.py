@@ -1,16 +1,27 @@
 from lstore.table import Table, Record
 from lstore.index import Index
+from itertools import count
+
+# Transaction ids tag log records; every run (retries included) gets a fresh one
+_txn_ids = count(1)
 
 class Transaction:
 
     """
     # Creates a transaction object.
+    # :param read_only: bool    #Read from a snapshot taken when the transaction first touches each table, without
+    #                           #taking any locks; writes are refused
     """
-    def __init__(self, lock_manager=None):
+    def __init__(self, lock_manager=None, read_only=False):
         self.queries = [] # Queued operations
-        self._undo_log = [] # Data that needs to roll back
         self.held_locks = {}
         self.lock_manager = lock_manager
+        self.txn_id = 0
+        # Age for wait-die deadlock prevention, set on the first run and kept across retries
+        self.timestamp = None
+        self.read_only = read_only
+        self._read_horizons = {} # Table -> horizon registered while this transaction runs
+        self._snapshots = {} # Table -> Snapshot read by a read-only transaction
         #self._locked_records = set() # Locks
 
     """
@@ -26,16 +37,26 @@ class Transaction:
 
         
     # If you choose to implement this differently this method must still return True if transaction commits or False on abort
-    # Execute queued queries in sequence. Before writing a query, it prepares rollback info. If query returns false, it will call abort(). If successful it calls commit()
+    # Execute queued queries in sequence. Tables remember what each write changed for rollback.
+    # If query returns false, it will call abort(). If successful it calls commit()
     def run(self):
-        self._undo_log = []
+        self.txn_id = next(_txn_ids)
+        if self.timestamp is None:
+            self.timestamp = self.txn_id
         self.held_locks = {}
         for query, table, args in self.queries:
             if self.lock_manager is None:
                 self.lock_manager = table.lock_manager
 
             query_name = getattr(query, "__name__", "")
-            undo_entry = None
+
+            if self.read_only:
+                if query_name in ("insert", "insert_many", "update", "update_many", "delete"):
+                    return self.abort()
+                self.snapshot(table)
+            elif table not in self._read_horizons:
+                # Keeps tail GC from reclaiming versions this transaction may still read or roll back to
+                self._read_horizons[table] = table.begin_read()
 
             
             if query_name in ("update", "delete"):
@@ -45,9 +66,6 @@ class Transaction:
                     rid = rids[0]
                     if not self.lock_manager.acquire_exclusive(self, rid):
                         return self.abort()
-                    before_image = table.get_record_data(rid, [1] * table.num_columns)
-                    if before_image is not None:
-                        undo_entry = (query_name, table, before_image)
 
             
             result = query(*args, transaction=self)
@@ -55,48 +73,56 @@ class Transaction:
             if result == False:
                 return self.abort()
 
-            if query_name == "insert":
-                undo_entry = ("insert", table, args[table.key])
-
-            if undo_entry is not None:
-                self._undo_log.append(undo_entry)
-
         return self.commit()
 
-    # Replays undo log in reverse to abort commits
+    # Rolls back in place: each table undoes this transaction's changes to it, newest first
     def abort(self):
-        if self.lock_manager:
+        for table in self._tables():
+            table.rollback(self)
+
+        for wal in self._logs():
+            wal.abort(self.txn_id)
+        self._finish()
+        # Locks are held until the rollback is done, so waiting transactions never see the aborted changes
+        if self.lock_manager is not None:
             self.lock_manager.release_all(self)
-        for op_type, table, payload in reversed(self._undo_log):
-            if op_type == "insert":
-                key = payload
-                rids = table.index.locate(table.key, key)
-                if rids:
-                    table.delete_record(rids[0])
-            elif op_type == "update":
-                previous_values = payload
-                key = previous_values[table.key]
-                rids = table.index.locate(table.key, key)
-                if rids:
-                    restored_columns = [None] * table.num_columns
-                    for i in range(table.num_columns):
-                        if i != table.key:
-                            restored_columns[i] = previous_values[i]
-                    table.update_record(rids[0], restored_columns)
-            elif op_type == "delete":
-                previous_values = payload
-                schema_encoding = '0' * table.num_columns
-                rid = table.add_base_record(previous_values, schema_encoding)
-                for col_idx in range(table.num_columns):
-                    if table.index.indices[col_idx] is not None:
-                        table.index.add_to_index(col_idx, previous_values[col_idx], rid)
-
-        self._undo_log = []
+        self._end_reads()
         return False
 
     # Clears temporary state
+    # The commit is durable once this returns: its log record is fsynced before any lock is released
     def commit(self):
-        if self.lock_manager:
+        for wal in self._logs():
+            wal.commit(self.txn_id)
+        self._finish()
+        if self.lock_manager is not None:
             self.lock_manager.release_all(self)
-        self._undo_log = []
-        return True
\ No newline at end of file
+        self._end_reads()
+        return True
+
+    """
+    # The snapshot this read-only transaction reads table through, taken on first use
+    """
+    def snapshot(self, table):
+        if table not in self._snapshots:
+            self._snapshots[table] = table.begin_snapshot()
+        return self._snapshots[table]
+
+    def _finish(self):
+        # Makes this transaction's writes visible to snapshots taken from now on
+        for table in self._tables():
+            table.finish_transaction(self)
+
+    def _tables(self):
+        return {table for _, table, _ in self.queries}
+
+    def _logs(self):
+        return {table.wal for _, table, _ in self.queries if getattr(table, 'wal', None) is not None}
+
+    def _end_reads(self):
+        for table, horizon in self._read_horizons.items():
+            table.end_read(horizon)
+        self._read_horizons = {}
+        for table, snapshot in self._snapshots.items():
+            table.end_snapshot(snapshot)
+        self._snapshots = {}
@@ -0,0 +1,316 @@
+"""
+Write-ahead log (<db path>/wal.log). Every change to a table is appended here before the pages it touched can
+reach disk, so Database.open can rebuild the state since the last checkpoint: it repeats history by redoing
+every record, then undoes the records of transactions that never committed or aborted.
+
+Records carry physical locations and full record images, which makes redo idempotent:
+    INSERT   table, rid, base page range, offset, base record columns
+    UPDATE   table, tail rid, tail page range, offset, base page range, offset, previous indirection,
+             tail record columns
+    DELETE   table, rid
+    COMMIT / ABORT
+    CREATE_TABLE table, num_columns, key, cumulative, page size / DROP_TABLE table
+    UNDO_INSERT / UNDO_UPDATE / UNDO_DELETE
+             compensation records written while a transaction rolls back, one per change undone, with the
+             fields of the record they undo. Undo is idempotent, so recovery simply redoes them as well
+Transaction id 0 is used for changes made outside a transaction; they never need undo.
+
+Commits are group committed: the first committer to find no flush in progress becomes the leader, optionally
+waits up to max_wait seconds for max_batch commits to queue up, and makes all of them durable with one
+write + fsync while the others wait for it.
+"""
+import os
+import struct
+import threading
+import zlib
+from collections import Counter, deque
+from time import perf_counter
+from lstore.bufferpool import PAGE_SIZE
+
+LOG_INSERT = 1
+LOG_UPDATE = 2
+LOG_DELETE = 3
+LOG_COMMIT = 4
+LOG_ABORT = 5
+LOG_CREATE_TABLE = 6
+LOG_DROP_TABLE = 7
+LOG_UNDO_INSERT = 8
+LOG_UNDO_UPDATE = 9
+LOG_UNDO_DELETE = 10
+
+# Payload length, CRC32 of everything after the CRC, record type, transaction id
+RECORD_HEADER = struct.Struct('<IIBq')
+CRC_PREFIX = struct.Struct('<Bq')
+
+# Buffered records are written out once they reach this size even if nobody asks for durability
+FLUSH_THRESHOLD = 1 << 20
+# Commit latencies kept for commit_stats
+LATENCY_SAMPLES = 100000
+
+
+def _pack_name(name):
+    name = name.encode('utf-8')
+    return struct.pack('<H', len(name)) + name
+
+
+def _unpack_name(payload, pos):
+    (length,) = struct.unpack_from('<H', payload, pos)
+    pos += 2
+    return payload[pos:pos + length].decode('utf-8'), pos + length
+
+
+def _pack_ints(values):
+    return struct.pack(f'<{len(values)}q', *values)
+
+
+def _unpack_ints(payload, pos):
+    count = (len(payload) - pos) // 8
+    return list(struct.unpack_from(f'<{count}q', payload, pos))
+
+
+class WriteAheadLog:
+
+    """
+    :param file_path: string    #Log file, created if missing
+    :param max_batch: int       #Commits a group commit leader waits for before flushing
+    :param max_wait: float      #Seconds a leader waits for the batch to fill, 0 to flush right away
+    """
+    def __init__(self, file_path, max_batch=64, max_wait=0.0):
+        self.file_path = file_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._fd = os.open(file_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._buffer = []
+        self._buffered = 0
+        # Bytes handed to the OS but not fsynced yet
+        self._unsynced = False
+        # Transactions with records in the log and no COMMIT/ABORT yet
+        self._active = set()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+
+        # COMMIT records numbered in log order: appended, handed to the OS, and known to be on stable storage
+        self._commit_seq = 0
+        self._written_seq = 0
+        self._durable_seq = 0
+        self._flushing = False
+
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._batch_sizes = Counter()
+        self.commits = 0
+
+    def _append(self, record_type, txn_id, payload):
+        body = CRC_PREFIX.pack(record_type, txn_id) + payload
+        crc = zlib.crc32(body)
+        record = RECORD_HEADER.pack(len(payload), crc, record_type, txn_id) + payload
+        with self._lock:
+            if txn_id and record_type not in (LOG_COMMIT, LOG_ABORT):
+                self._active.add(txn_id)
+            self._buffer.append(record)
+            self._buffered += len(record)
+            if record_type == LOG_COMMIT:
+                self._commit_seq += 1
+                # A leader waiting for its batch to fill may be able to go now
+                self._cond.notify_all()
+            if self._buffered >= FLUSH_THRESHOLD:
+                self._write_buffer()
+            return self._commit_seq
+
+    # Called with _lock held
+    def _write_buffer(self):
+        if self._buffer:
+            os.write(self._fd, b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+            self._unsynced = True
+        self._written_seq = self._commit_seq
+
+    def _flush(self):
+        """
+        Called with _lock held and no flush in progress. Writes everything buffered and fsyncs it; the lock
+        is dropped during the fsync so other threads keep appending (and queue up for the next batch).
+        """
+        self._write_buffer()
+        target = self._written_seq
+        if self._unsynced:
+            self._flushing = True
+            self._unsynced = False
+            self._lock.release()
+            try:
+                os.fsync(self._fd)
+            finally:
+                self._lock.acquire()
+                self._flushing = False
+        if target > self._durable_seq:
+            self._batch_sizes[target - self._durable_seq] += 1
+            self._durable_seq = target
+        self._cond.notify_all()
+
+    def log_insert(self, txn_id, table_name, rid, range_idx, offset, values):
+        self._append(LOG_INSERT, txn_id,
+                     _pack_name(table_name) + _pack_ints([rid, range_idx, offset]) + _pack_ints(values))
+
+    def log_update(self, txn_id, table_name, tail_rid, tail_range, tail_offset, base_range, base_offset,
+                   prev_indirection, values):
+        header = [tail_rid, tail_range, tail_offset, base_range, base_offset, prev_indirection]
+        self._append(LOG_UPDATE, txn_id, _pack_name(table_name) + _pack_ints(header) + _pack_ints(values))
+
+    def log_delete(self, txn_id, table_name, rid):
+        self._append(LOG_DELETE, txn_id, _pack_name(table_name) + _pack_ints([rid]))
+
+    def log_undo_insert(self, txn_id, table_name, rid):
+        self._append(LOG_UNDO_INSERT, txn_id, _pack_name(table_name) + _pack_ints([rid]))
+
+    def log_undo_update(self, txn_id, table_name, tail_rid, base_range, base_offset, prev_indirection):
+        self._append(LOG_UNDO_UPDATE, txn_id,
+                     _pack_name(table_name) + _pack_ints([tail_rid, base_range, base_offset, prev_indirection]))
+
+    def log_undo_delete(self, txn_id, table_name, rid):
+        self._append(LOG_UNDO_DELETE, txn_id, _pack_name(table_name) + _pack_ints([rid]))
+
+    def log_create_table(self, table_name, num_columns, key, cumulative=True, page_size=PAGE_SIZE):
+        self._append(LOG_CREATE_TABLE, 0,
+                     _pack_name(table_name) + _pack_ints([num_columns, key, int(cumulative), page_size]))
+
+    def log_drop_table(self, table_name):
+        self._append(LOG_DROP_TABLE, 0, _pack_name(table_name))
+
+    def commit(self, txn_id):
+        """
+        Appends the transaction's COMMIT and returns once it is on stable storage, usually as part of a
+        group of concurrent commits flushed together
+        """
+        with self._lock:
+            if txn_id not in self._active:
+                # Nothing was logged, so there is nothing to make durable
+                return
+        start = perf_counter()
+        seq = self._append(LOG_COMMIT, txn_id, b'')
+        with self._cond:
+            self._active.discard(txn_id)
+            while self._durable_seq < seq:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                remaining = self.max_wait - (perf_counter() - start)
+                if self._commit_seq - self._durable_seq < self.max_batch and remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._flush()
+            self._latencies.append(perf_counter() - start)
+            self.commits += 1
+
+    def abort(self, txn_id):
+        with self._lock:
+            if txn_id not in self._active:
+                return
+        self._append(LOG_ABORT, txn_id, b'')
+        with self._lock:
+            self._active.discard(txn_id)
+
+    def sync(self):
+        """
+        Writes out buffered records and fsyncs the log. Called before any page is written back, so no page
+        on disk is ahead of the log.
+        """
+        with self._cond:
+            self._write_buffer()
+            # Bytes written while another thread's fsync was in progress may have missed it
+            while self._flushing or self._unsynced:
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._flush()
+
+    def commit_stats(self):
+        """
+        Commit latency percentiles (seconds) over the most recent commits, and how many commits each
+        group commit flush made durable ({batch size: number of flushes})
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            commits = self.commits
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+        return {
+            'commits': commits,
+            'flushes': sum(batch_sizes.values()),
+            'latency_p50': percentile(50),
+            'latency_p95': percentile(95),
+            'latency_p99': percentile(99),
+            'latency_max': latencies[-1] if latencies else 0.0,
+            'batch_sizes': batch_sizes,
+        }
+
+    def mark(self):
+        """
+        Start of a checkpoint: returns the log position every later change is logged after
+        """
+        self.sync()
+        with self._lock:
+            return os.fstat(self._fd).st_size
+
+    def truncate(self, position):
+        """
+        End of a checkpoint: drops the records before position, whose effects the checkpoint wrote, except
+        those of transactions still active (recovery may have to undo them)
+        """
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._write_buffer()
+            with open(self.file_path, 'rb') as f:
+                raw = f.read()
+            kept = [record for record_type, txn_id, payload, record in self._scan(raw[:position])
+                    if txn_id in self._active]
+            kept.append(raw[position:])
+            tmp_path = self.file_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(kept))
+                f.flush()
+                os.fsync(f.fileno())
+            os.close(self._fd)
+            os.replace(tmp_path, self.file_path)
+            self._fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            self._unsynced = False
+
+    @staticmethod
+    def _scan(raw):
+        # Yields (type, txn id, payload, raw record); stops at a torn or corrupt record at the end of the log
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(raw):
+            length, crc, record_type, txn_id = RECORD_HEADER.unpack_from(raw, pos)
+            end = pos + RECORD_HEADER.size + length
+            if end > len(raw):
+                return
+            payload = raw[pos + RECORD_HEADER.size:end]
+            if zlib.crc32(CRC_PREFIX.pack(record_type, txn_id) + payload) != crc:
+                return
+            yield record_type, txn_id, payload, raw[pos:end]
+            pos = end
+
+    def records(self):
+        """
+        Decodes the log for recovery: a list of (type, txn id, fields) in log order
+        """
+        self.sync()
+        with open(self.file_path, 'rb') as f:
+            raw = f.read()
+        decoded = []
+        for record_type, txn_id, payload, _ in self._scan(raw):
+            if record_type in (LOG_COMMIT, LOG_ABORT):
+                fields = None
+            else:
+                table_name, pos = _unpack_name(payload, 0)
+                fields = [table_name] + _unpack_ints(payload, pos)
+            decoded.append((record_type, txn_id, fields))
+        return decoded
+
+    def close(self):
+        self.sync()
+        os.close(self._fd)
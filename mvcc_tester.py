@@ -0,0 +1,111 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+
+from random import randint, sample, seed
+import shutil
+
+# Snapshot reads: writer workers move money between accounts while read-only transactions sum the balances
+# next to them without taking locks. Every snapshot must see the total that transfers keep constant
+shutil.rmtree('./ECS165_mvcc', ignore_errors=True)
+db = Database()
+db.open('./ECS165_mvcc')
+# [account, balance, number of transfers touching the account]
+accounts_table = db.create_table('Accounts', 3, 0)
+query = Query(accounts_table)
+
+number_of_accounts = 1000
+number_of_transactions = 1000
+transfers_per_transaction = 5
+num_writers = 8
+number_of_audits = 100
+num_readers = 2
+seed(3562901)
+
+keys = [92106429 + i for i in range(number_of_accounts)]
+for key in keys:
+    query.insert(key, 100, 0)
+total = 100 * number_of_accounts
+
+
+def transfer(source, target, amount, transaction=None):
+    # Reads both balances under the transaction's locks and moves amount from source to target
+    found = [query.select(key, 0, [1, 1, 1], transaction=transaction) for key in (source, target)]
+    if not all(found):
+        return False
+    source_balance, source_count = found[0][0].columns[1:]
+    target_balance, target_count = found[1][0].columns[1:]
+    if not query.update(source, None, source_balance - amount, source_count + 1, transaction=transaction):
+        return False
+    return query.update(target, None, target_balance + amount, target_count + 1, transaction=transaction)
+
+
+audit_errors = []
+
+
+def audit(transaction=None):
+    # Runs in a read-only transaction, which takes no locks: its two reads see the same snapshot, so the halves
+    # must add up to the total even though transfers commit in between
+    low = query.sum(keys[0], keys[499], 1, transaction=transaction)
+    high = query.sum(keys[500], keys[-1], 1, transaction=transaction)
+    if low is False or high is False:
+        return False
+    if low + high != total:
+        audit_errors.append(low + high)
+    return True
+
+
+transaction_workers = []
+for i in range(num_writers):
+    transaction_workers.append(TransactionWorker())
+for i in range(number_of_transactions):
+    t = Transaction()
+    for _ in range(transfers_per_transaction):
+        source, target = sample(keys, 2)
+        t.add_query(transfer, accounts_table, source, target, randint(1, 20))
+    transaction_workers[i % num_writers].add_transaction(t)
+
+audit_workers = []
+for i in range(num_readers):
+    audit_workers.append(TransactionWorker())
+for i in range(number_of_audits):
+    t = Transaction(read_only=True)
+    t.add_query(audit, accounts_table)
+    audit_workers[i % num_readers].add_transaction(t)
+
+for worker in transaction_workers + audit_workers:
+    worker.run()
+for worker in transaction_workers + audit_workers:
+    worker.join()
+
+committed = sum(worker.result for worker in transaction_workers)
+if committed != number_of_transactions:
+    print('transfer error:', number_of_transactions - committed, 'transactions never committed')
+audits = sum(worker.result for worker in audit_workers)
+if audits != number_of_audits:
+    print('snapshot error:', number_of_audits - audits, 'read-only transactions failed')
+for result in audit_errors:
+    print('snapshot error: balances sum to', result, ', correct:', total)
+print("Transfers finished")
+
+# Outside any transaction the balances still add up and every transfer touched two accounts
+accounts_table.wait_for_merge()
+result = query.sum(keys[0], keys[-1], 1)
+if result != total:
+    print('sum error: balances sum to', result, ', correct:', total)
+result = query.sum(keys[0], keys[-1], 2)
+if result != 2 * transfers_per_transaction * number_of_transactions:
+    print('sum error: transfer counts sum to', result, ', correct:',
+          2 * transfers_per_transaction * number_of_transactions)
+# Enough transfers ran for merges to rewrite the base pages; the opening balances are still the oldest version
+result = query.sum_version(keys[0], keys[-1], 1, -2 * transfers_per_transaction * number_of_transactions)
+if result != total:
+    print('sum_version error: opening balances sum to', result, ', correct:', total)
+for key in keys:
+    record = query.select_version(key, 0, [1, 1, 1], -2 * transfers_per_transaction * number_of_transactions)[0]
+    if record.columns != [key, 100, 0]:
+        print('select_version error on', key, ':', record.columns, ', correct:', [key, 100, 0])
+print("Sum finished")
+
+db.close()
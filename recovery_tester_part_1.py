@@ -0,0 +1,88 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+from random import randint, seed
+import os
+import shutil
+
+# Crash recovery, part 1: commits some transactions, aborts one and crashes in the middle of another without
+# calling db.close(). recovery_tester_part_2.py reopens the database and checks what survived
+shutil.rmtree('./ECS165_recovery', ignore_errors=True)
+db = Database()
+db.open('./ECS165_recovery')
+grades_table = db.create_table('Grades', 5, 0)
+query = Query(grades_table)
+
+number_of_records = 1000
+seed(3562901)
+
+# The same records and changes are generated again by part 2
+records = {}
+keys = []
+for i in range(0, number_of_records):
+    key = 92106429 + i
+    keys.append(key)
+    records[key] = [key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]
+
+committed_updates = {key: [None, randint(0, 20), randint(0, 20), None, randint(0, 20)] for key in keys[0:200]}
+committed_inserts = [[92107429 + i, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)] for i in range(50)]
+committed_deletes = keys[900:950]
+aborted_updates = {key: [None, randint(0, 20), None, None, None] for key in keys[200:210]}
+unfinished_updates = {key: [None, None, 1000 + randint(0, 20), None, None] for key in keys[300:400]}
+unfinished_inserts = [[92108429 + i, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)] for i in range(50)]
+unfinished_deletes = keys[950:1000]
+late_updates = {key: [None, None, None, randint(0, 20), None] for key in keys[400:450]}
+
+for key in keys:
+    query.insert(*records[key])
+# The inserts reach the page files; everything below is recovered from the log on top of this checkpoint
+db.checkpoint()
+print("Insert finished")
+
+committed = Transaction()
+for key, columns in committed_updates.items():
+    committed.add_query(query.update, grades_table, key, *columns)
+for columns in committed_inserts:
+    committed.add_query(query.insert, grades_table, *columns)
+for key in committed_deletes:
+    committed.add_query(query.delete, grades_table, key)
+if not committed.run():
+    print('committed transaction aborted')
+
+# Updating a key that does not exist fails, so this transaction rolls back its first ten updates
+aborted = Transaction()
+for key, columns in aborted_updates.items():
+    aborted.add_query(query.update, grades_table, key, *columns)
+aborted.add_query(query.update, grades_table, 1, None, 1, None, None, None)
+if aborted.run():
+    print('aborted transaction committed')
+for key in aborted_updates:
+    record = query.select(key, 0, [1, 1, 1, 1, 1])[0]
+    if record.columns != records[key]:
+        print('rollback error on', key, ':', record.columns, ', correct:', records[key])
+print("Commit and abort finished")
+
+
+def crash(transaction=None):
+    # Writes the unfinished transaction's changes to the page files (its log records stay in the log), commits
+    # one more transaction that only reaches the log, then dies without closing the database
+    db.checkpoint()
+    late = Transaction()
+    for key, columns in late_updates.items():
+        late.add_query(query.update, grades_table, key, *columns)
+    if not late.run():
+        print('late transaction aborted')
+    print("Crashing")
+    os._exit(0)
+
+
+unfinished = Transaction()
+for key, columns in unfinished_updates.items():
+    unfinished.add_query(query.update, grades_table, key, *columns)
+for columns in unfinished_inserts:
+    unfinished.add_query(query.insert, grades_table, *columns)
+for key in unfinished_deletes:
+    unfinished.add_query(query.delete, grades_table, key)
+unfinished.add_query(crash, grades_table)
+unfinished.run()
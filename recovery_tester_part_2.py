@@ -0,0 +1,84 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, seed
+
+# Crash recovery, part 2: run after recovery_tester_part_1.py. Opening the database redoes the log and undoes
+# the transaction that was running when part 1 crashed
+db = Database()
+db.open('./ECS165_recovery')
+grades_table = db.get_table('Grades')
+query = Query(grades_table)
+
+number_of_records = 1000
+seed(3562901)
+
+# re-generate the records and changes of part 1
+records = {}
+keys = []
+for i in range(0, number_of_records):
+    key = 92106429 + i
+    keys.append(key)
+    records[key] = [key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]
+
+committed_updates = {key: [None, randint(0, 20), randint(0, 20), None, randint(0, 20)] for key in keys[0:200]}
+committed_inserts = [[92107429 + i, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)] for i in range(50)]
+committed_deletes = keys[900:950]
+aborted_updates = {key: [None, randint(0, 20), None, None, None] for key in keys[200:210]}
+unfinished_updates = {key: [None, None, 1000 + randint(0, 20), None, None] for key in keys[300:400]}
+unfinished_inserts = [[92108429 + i, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)] for i in range(50)]
+unfinished_deletes = keys[950:1000]
+late_updates = {key: [None, None, None, randint(0, 20), None] for key in keys[400:450]}
+
+# Only the committed transactions count
+for updates in (committed_updates, late_updates):
+    for key, columns in updates.items():
+        records[key] = [old if new is None else new for old, new in zip(records[key], columns)]
+for columns in committed_inserts:
+    records[columns[0]] = list(columns)
+for key in committed_deletes:
+    del records[key]
+missing_keys = committed_deletes + [columns[0] for columns in unfinished_inserts]
+
+
+def check(query):
+    for key in sorted(records):
+        found = query.select(key, 0, [1, 1, 1, 1, 1])
+        if not found:
+            print('select error on', key, ': missing, correct:', records[key])
+        elif found[0].columns != records[key]:
+            print('select error on', key, ':', found[0].columns, ', correct:', records[key])
+    for key in missing_keys:
+        if query.select(key, 0, [1, 1, 1, 1, 1]):
+            print('select error on', key, ': found a record that should not exist')
+
+    # The key index holds exactly the surviving records
+    indexed = grades_table.index.locate_range(min(keys), max(missing_keys + list(records)), 0)
+    if len(indexed) != len(records):
+        print('index error:', len(indexed), 'keys indexed, correct:', len(records))
+    for key in missing_keys:
+        if grades_table.index.locate(0, key):
+            print('index error on', key, ': still indexed')
+
+    for column in range(5):
+        result = query.sum(min(records), max(records), column)
+        if result != sum(columns[column] for columns in records.values()):
+            print('sum error on column', column, ':', result, ', correct:', sum(r[column] for r in records.values()))
+
+
+check(query)
+# A secondary index built from the recovered data must not see the values the unfinished transaction wrote
+grades_table.index.create_index(2)
+for value in range(1000, 1021):
+    if grades_table.index.locate(2, value):
+        print('index error: value', value, 'of the unfinished transaction is indexed')
+print("Recovery finished")
+
+# Recovery leaves a database that closes and reopens cleanly
+db.close()
+db = Database()
+db.open('./ECS165_recovery')
+grades_table = db.get_table('Grades')
+check(Query(grades_table))
+db.close()
+print("Reopen finished")